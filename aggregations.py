@@ -0,0 +1,405 @@
+# Import libraries
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+import cohorts
+import distinct_count
+import fulfillment
+import ingestion
+import instrumentation
+import my_functions
+import revenue
+import sku_index
+
+# Columns identifying a cell of the sales cube
+CUBE_KEYS = ['Date', 'Ship State', 'Ship Country']
+
+# Cubes and the aggregates derived from them, keyed by the fingerprint of the
+# orders they summarize; each dataset has a dozen small entries
+cube_cache = ingestion.FrameCache(max_entries=64, max_bytes=128 * 1024 ** 2)
+
+# The results of aggregate_orders_in_chunks: a preview of the orders and the
+# aggregates the panels use in place of the orders
+StreamedOrders = namedtuple('StreamedOrders', [
+    'preview', 'sales_cube', 'orders_by_state', 'daily_revenue', 'latency_cube', 'sku_index', 'cohort_table',
+])
+
+# Define functions
+
+def _labels(codes, uniques):
+    # Map factorize codes back to their labels, with NaN for the code -1
+    labels = np.append(np.asarray(uniques, dtype=object), np.nan)
+    return pd.Categorical(labels[codes])
+
+@instrumentation.timed()
+def build_sales_cube(df):
+    """
+    Summarizes the orders in one pass into a daily x state x country cube.
+
+    Parameters:
+        df (pandas.DataFrame): A DataFrame containing order data, with the
+        'sale_date_datetime' column of add_date_columns and the columns
+        'Order ID', 'Number of Items', 'Ship State' and 'Ship Country'.
+        'Order Value' is summed when present.
+
+    Returns:
+        pandas.DataFrame: One row per (Date, Ship State, Ship Country) with
+        orders, sorted by date, with columns 'Number of Items', 'Number of
+        Orders' (distinct Order IDs) and 'Order Value'.
+    """
+    # Encode the states and countries as integers; missing values get -1
+    state_codes, states = pd.factorize(df['Ship State'])
+    country_codes, countries = pd.factorize(df['Ship Country'])
+
+    # An order is sold on a single day to a single address, so distinct order
+    # counts can be summed across cells without double counting
+    keys = pd.DataFrame({
+        'Date': df['sale_date_datetime'].to_numpy(),
+        'state': state_codes,
+        'country': country_codes,
+        'Number of Items': df['Number of Items'].to_numpy(),
+        'Order ID': df['Order ID'].to_numpy(),
+        'Order Value': df['Order Value'].to_numpy() if 'Order Value' in df.columns else 0.0,
+    })
+    cube = keys.groupby(['Date', 'state', 'country'], sort=True).agg(**{
+        'Number of Items': ('Number of Items', 'sum'),
+        'Number of Orders': ('Order ID', 'nunique'),
+        'Order Value': ('Order Value', 'sum'),
+    }).reset_index()
+
+    # Replace the codes with the state and country labels
+    cube['Ship State'] = _labels(cube.pop('state').to_numpy(), states)
+    cube['Ship Country'] = _labels(cube.pop('country').to_numpy(), countries)
+
+    return cube[CUBE_KEYS + ['Number of Items', 'Number of Orders', 'Order Value']]
+
+def memoize_by_fingerprint(df, name, compute):
+    """
+    Returns compute(), memoized in cube_cache under df.attrs['fingerprint']
+    and name, so that it runs only once per dataset. compute() must return a
+    DataFrame or Series. Without a fingerprint the result is not cached.
+    """
+    fingerprint = df.attrs.get('fingerprint')
+    key = None if fingerprint is None else f'{fingerprint}:{name}'
+    result = cube_cache.get(key) if key is not None else None
+    if result is None:
+        result = compute()
+        if key is not None:
+            result = cube_cache.put(key, result)
+    return result
+
+def get_sales_cube(df):
+    """
+    Returns the sales cube of the orders, building it only once per dataset.
+    """
+    return memoize_by_fingerprint(df, 'sales_cube', lambda: build_sales_cube(df))
+
+@instrumentation.timed()
+def merge_sales_cubes(cubes):
+    """
+    Merges sales cubes built from separate parts of the orders (such as the
+    chunks of a large export) into the cube of all the orders, summing the
+    cells that appear in several parts. Distinct order counts are exact as
+    long as no order is split across parts, which holds for the "Sold
+    Orders" export where every order is a single row; count_orders_by_state
+    is exact in every case.
+    """
+    # Concatenate the cubes with plain labels, since their categories differ
+    cube = pd.concat(
+        [part.astype({'Ship State': object, 'Ship Country': object}) for part in cubes],
+        ignore_index=True)
+    cube = cube.groupby(CUBE_KEYS, sort=True, dropna=False).sum().reset_index()
+
+    cube['Ship State'] = cube['Ship State'].astype('category')
+    cube['Ship Country'] = cube['Ship Country'].astype('category')
+    return cube
+
+def _find_new_orders(seen_runs, order_ids):
+    # Return whether each order is the first with its Order ID, neither in the
+    # sorted runs of seen_runs nor earlier in order_ids, and add the new ids to
+    # seen_runs as a run. Runs of similar size are merged, like the levels of
+    # an LSM tree, so that each id is merged O(log n) times and each lookup is
+    # one binary search per run
+    chunk_ids, first_rows = np.unique(order_ids, return_index=True)
+    seen = np.zeros(len(chunk_ids), dtype=bool)
+    for run in seen_runs:
+        positions = np.minimum(np.searchsorted(run, chunk_ids), len(run) - 1)
+        seen |= run[positions] == chunk_ids
+
+    new_ids = chunk_ids[~seen]
+    if len(new_ids):
+        seen_runs.append(new_ids)
+        while len(seen_runs) > 1 and len(seen_runs[-2]) <= 2 * len(seen_runs[-1]):
+            run = seen_runs.pop()
+            seen_runs[-1] = np.sort(np.concatenate([seen_runs[-1], run]), kind='stable')
+
+    is_new = np.zeros(len(order_ids), dtype=bool)
+    is_new[first_rows[~seen]] = True
+    return is_new
+
+@instrumentation.timed()
+def aggregate_orders_in_chunks(data, chunksize=100_000, mask=True, preview_rows=5):
+    """
+    Builds the sales cube of an Etsy "Sold Orders" CSV export chunk by chunk:
+    each chunk is parsed, masked and summarized, and merged into the running
+    cube, so that only one chunk of orders is in memory at any time. When
+    several exports are given, orders whose Order ID was already read, from
+    an earlier chunk or an earlier, overlapping export, are skipped.
+
+    Parameters:
+        data (bytes or list): The contents of the CSV export, or a list of
+        the contents of several exports.
+        chunksize (int): The number of rows parsed at once. Defaults to 100,000.
+        mask (bool): Whether to mask the buyer name columns. Defaults to True.
+        preview_rows (int): The number of orders kept for display. Defaults to 5.
+
+    Returns:
+        StreamedOrders: The first preview_rows prepared orders ('preview'),
+        whose attrs hold the fingerprint of the export, the sales cube of all
+        the orders, the exact number of orders by US state (as from
+        get_orders_by_state), the daily revenue of all the orders (as from
+        revenue.build_daily_revenue), their latency cube (as from
+        fulfillment.build_latency_cube), their SKU index (as from
+        sku_index.build_sku_index) and their cohort table (as from
+        cohorts.cohort_table). All of them are cached by the content of the
+        export.
+    """
+    datas = [data] if isinstance(data, bytes) else list(data)
+    fingerprint = ingestion.combine_keys([ingestion.make_cache_key(data, mask=mask) for data in datas]) + ':stream'
+
+    preview = ingestion.frame_cache.get(fingerprint)
+    cube = cube_cache.get(f'{fingerprint}:sales_cube')
+    orders_by_state = cube_cache.get(f'{fingerprint}:orders_by_state')
+    daily_revenue = cube_cache.get(f'{fingerprint}:daily_revenue')
+    latency_cube = cube_cache.get(f'{fingerprint}:latency_cube')
+    skus = cube_cache.get(f'{fingerprint}:sku_index')
+    buyer_cohorts = cube_cache.get(f'{fingerprint}:cohort_table')
+    if any(result is None for result in (preview, cube, orders_by_state, daily_revenue, latency_cube, skus, buyer_cohorts)):
+        preview, cube, daily_revenue, latency_cube, skus, buyer_months = None, None, None, None, None, None
+        state_orders = distinct_count.DistinctCounter()
+        seen_ids = []
+        for chunk in (chunk for data in datas for chunk in ingestion.iter_order_chunks(data, chunksize=chunksize, mask=mask)):
+            # Skip the orders that an earlier, overlapping export already had;
+            # a single export lists every order once
+            if len(datas) > 1:
+                is_new = _find_new_orders(seen_ids, chunk['Order ID'].to_numpy(dtype=np.int64))
+                if not is_new.all():
+                    chunk = chunk[is_new]
+            if len(chunk) == 0 and preview is not None:
+                continue
+
+            if preview is None:
+                preview = chunk.head(preview_rows).copy()
+            # Merge each chunk's cube into the running cube, so that the parts
+            # never accumulate
+            chunk_cube = build_sales_cube(chunk)
+            cube = chunk_cube if cube is None else merge_sales_cubes([cube, chunk_cube])
+            chunk_revenue = revenue.build_daily_revenue(chunk)
+            daily_revenue = chunk_revenue if daily_revenue is None else revenue.merge_daily_revenue([daily_revenue, chunk_revenue])
+            chunk_latency = fulfillment.build_latency_cube(chunk)
+            latency_cube = chunk_latency if latency_cube is None else fulfillment.merge_latency_cubes([latency_cube, chunk_latency])
+            chunk_skus = sku_index.build_sku_index(chunk)
+            skus = chunk_skus if skus is None else sku_index.merge_sku_indexes([skus, chunk_skus])
+            chunk_buyer_months = cohorts.build_buyer_months(chunk)
+            buyer_months = (chunk_buyer_months if buyer_months is None
+                            else cohorts.merge_buyer_months([buyer_months, chunk_buyer_months]))
+            # Count the orders of each state exactly, even if an order spans chunks
+            state_orders.merge(count_orders_by_state(chunk))
+
+        preview.attrs['fingerprint'] = fingerprint
+        preview = ingestion.frame_cache.put(fingerprint, preview)
+        cube = cube_cache.put(f'{fingerprint}:sales_cube', cube)
+        orders_by_state = cube_cache.put(f'{fingerprint}:orders_by_state', orders_by_state_from_counter(state_orders))
+        daily_revenue = cube_cache.put(f'{fingerprint}:daily_revenue', daily_revenue)
+        latency_cube = cube_cache.put(f'{fingerprint}:latency_cube', latency_cube)
+        skus = cube_cache.put(f'{fingerprint}:sku_index', skus)
+        buyer_cohorts = cube_cache.put(f'{fingerprint}:cohort_table', cohorts.cohort_table(buyer_months))
+
+    return StreamedOrders(preview, cube, orders_by_state, daily_revenue, latency_cube, skus, buyer_cohorts)
+
+def daily_sales_from_cube(cube):
+    """
+    Returns the same DataFrame as my_functions.get_clean_sales_data_by_date:
+    the items sold on every day between the first and last sale, with columns
+    'Date' and 'Total Quantity Sold'.
+    """
+    daily = cube.groupby('Date')['Number of Items'].sum()
+
+    # Fill the days without sales with zero
+    date_range = pd.date_range(start=daily.index.min(), end=daily.index.max(), freq='D', name='Date')
+    daily = daily.reindex(date_range, fill_value=0).astype('float64')
+
+    return daily.rename('Total Quantity Sold').reset_index()
+
+def monthly_sum_from_cube(cube):
+    """
+    Returns the same DataFrame as my_functions.calculate_monthly_sum: the
+    items sold in each month 1-12, with columns 'month' and 'Number of Sold
+    Items'.
+    """
+    monthly = cube.groupby(cube['Date'].dt.month.rename('month'))['Number of Items'].sum()
+    monthly = monthly.reindex(range(1, 13), fill_value=0).astype('float64')
+    return monthly.rename('Number of Sold Items').reset_index()
+
+def year_month_sum_from_cube(cube):
+    """
+    Returns the same DataFrame as my_functions.calculate_year_month_sum: the
+    items sold in every month between the first and last sale, with columns
+    'year_month' and 'Number of Sold Items'.
+    """
+    monthly = cube.groupby(cube['Date'].dt.to_period('M'))['Number of Items'].sum()
+    all_months = pd.period_range(monthly.index.min(), monthly.index.max(), freq='M')
+    monthly = monthly.reindex(all_months, fill_value=0).astype('float64')
+    return pd.DataFrame({'year_month': all_months.strftime('%Y-%m'), 'Number of Sold Items': monthly.to_numpy()})
+
+def spans_several_years(cube):
+    """
+    Returns whether the sales of the cube, which is sorted by date, fall in
+    more than one calendar year.
+    """
+    return len(cube) > 0 and cube['Date'].iloc[0].year != cube['Date'].iloc[-1].year
+
+def weekday_weekend_from_cube(cube):
+    """
+    Returns the same Series as my_functions.get_sales_by_weekday_weekend: the
+    items sold on weekdays (False) and weekends (True).
+    """
+    is_weekend = (cube['Date'].dt.dayofweek >= 5).rename('is_weekend')
+    return cube.groupby(is_weekend)['Number of Items'].sum()
+
+def orders_by_state_from_cube(cube):
+    """
+    Returns the same DataFrame as my_functions.get_orders_by_state: the
+    number of orders from the United States by state, with columns 'Ship
+    State' and 'Number of Orders'.
+    """
+    cube_us = cube[cube['Ship Country'] == 'United States']
+    orders_by_state = cube_us.groupby('Ship State', observed=True)['Number of Orders'].sum().reset_index()
+    orders_by_state['Ship State'] = orders_by_state['Ship State'].astype(object)
+    return orders_by_state
+
+def count_orders_by_state(df, approximate=False):
+    """
+    Returns a mergeable distinct_count.DistinctCounter of the Order IDs from
+    the United States by state. Counters of separate chunks of the orders can
+    be merged into the counts of all of them.
+
+    Parameters:
+        df (pandas.DataFrame): A DataFrame containing order data, including
+        columns 'Order ID', 'Ship State' and 'Ship Country'.
+        approximate (bool): Whether to count with HyperLogLog sketches instead
+        of exact sets of Order IDs. Defaults to False.
+    """
+    df_us = df[df['Ship Country'] == 'United States']
+    counter = distinct_count.DistinctCounter(approximate=approximate)
+    return counter.add(df_us['Ship State'].to_numpy(dtype=object), df_us['Order ID'].to_numpy())
+
+def orders_by_state_from_counter(counter):
+    """
+    Returns the same DataFrame as my_functions.get_orders_by_state from the
+    counter of count_orders_by_state.
+    """
+    counts = counter.counts().sort_index()
+    return pd.DataFrame({'Ship State': counts.index.astype(object), 'Number of Orders': counts.to_numpy()})
+
+def rank_orders_by_state(orders_by_state, state_col='Ship State', orders_col='Number of Orders'):
+    """
+    Sorts the number of orders by state once, in descending order of the
+    number of orders (ties keep their order), and adds the running total of
+    the orders in a 'Cumulative Orders' column, so that the top n states and
+    the 'Others' category can be read off without sorting again.
+
+    Parameters:
+        orders_by_state (pandas.DataFrame): A DataFrame such as the output of
+        my_functions.clean_orders_by_state.
+
+    Returns:
+        pandas.DataFrame: The ranked states, with columns specified by the
+        state_col and orders_col parameters and 'Cumulative Orders'.
+    """
+    ranked = orders_by_state[[state_col, orders_col]].sort_values(orders_col, ascending=False, kind='mergesort')
+    ranked['Cumulative Orders'] = ranked[orders_col].cumsum()
+    return ranked
+
+def group_ranked_orders_by_state(ranked, n=10, state_col='Ship State', orders_col='Number of Orders'):
+    """
+    Returns the same DataFrame as my_functions.group_orders_by_state for the
+    output of rank_orders_by_state: the top n states and an 'Others' row with
+    the orders of the remaining states. Only the first n rows are touched.
+    """
+    n = min(max(n, 0), len(ranked))
+    cumulative = ranked['Cumulative Orders'].to_numpy()
+
+    # The orders of the remaining states are the total minus the top n
+    total = cumulative[-1] if len(cumulative) else 0
+    other_orders = total - (cumulative[n - 1] if n else 0)
+
+    other_states = pd.DataFrame({
+        state_col: ['Others'],
+        orders_col: [other_orders]
+    })
+    return pd.concat([ranked.iloc[:n][[state_col, orders_col]], other_states])
+
+def get_ranked_states(df, cube=None, orders_by_state=None):
+    """
+    Returns the cleaned US states ranked by number of orders, computing them
+    only once per dataset from orders_by_state when given, or else from the
+    sales cube, or by my_functions.get_orders_by_state when the SQL backend is
+    switched on and no cube is given.
+    """
+    def compute():
+        state_orders = orders_by_state
+        if state_orders is None and cube is None and my_functions.use_sql_backend():
+            state_orders = my_functions.get_orders_by_state(df)
+        elif state_orders is None:
+            state_orders = orders_by_state_from_cube(get_sales_cube(df) if cube is None else cube)
+        return rank_orders_by_state(my_functions.clean_orders_by_state(state_orders))
+
+    return memoize_by_fingerprint(df, 'ranked_states', compute)
+
+def get_daily_sales(df, cube=None):
+    """
+    Returns the daily items sold of daily_sales_from_cube, or of
+    my_functions.get_clean_sales_data_by_date when the SQL backend is switched
+    on and no cube is given, indexed by date with my_functions.index_by_date
+    so that date ranges can be sliced with a binary search. Computed only once
+    per dataset.
+    """
+    def compute():
+        if cube is None and my_functions.use_sql_backend():
+            return my_functions.index_by_date(my_functions.get_clean_sales_data_by_date(df))
+        return my_functions.index_by_date(daily_sales_from_cube(get_sales_cube(df) if cube is None else cube))
+
+    return memoize_by_fingerprint(df, 'daily_sales', compute)
+
+def get_daily_revenue(df):
+    """
+    Returns the daily sums of the money columns of revenue.build_daily_revenue,
+    computed only once per dataset and shared by every revenue panel.
+    """
+    return memoize_by_fingerprint(df, 'daily_revenue', lambda: revenue.build_daily_revenue(df))
+
+def get_latency_cube(df):
+    """
+    Returns the fulfillment latency histograms of fulfillment.build_latency_cube,
+    computed only once per dataset, so that changing the date range only sums
+    the weeks in it.
+    """
+    return memoize_by_fingerprint(df, 'latency_cube', lambda: fulfillment.build_latency_cube(df))
+
+def get_sku_index(df):
+    """
+    Returns the SKU x day matrix of sku_index.build_sku_index, computed only
+    once per dataset.
+    """
+    return memoize_by_fingerprint(df, 'sku_index', lambda: sku_index.build_sku_index(df))
+
+def get_cohort_table(df):
+    """
+    Returns the first-purchase cohorts of the buyers of cohorts.cohort_table,
+    computed only once per dataset.
+    """
+    return memoize_by_fingerprint(df, 'cohort_table', lambda: cohorts.cohort_table(cohorts.build_buyer_months(df)))
@@ -1,14 +1,39 @@
+import os
+import time
+
+# Use a non-interactive matplotlib backend in this process and the render
+# workers, whenever matplotlib ends up being imported
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+import_start = time.perf_counter()
+import tracemalloc
 import streamlit as st
-import pandas as pd
+import instrumentation
 import my_functions
-import matplotlib.pyplot as plt
-import datetime
+import ingestion
+import aggregations
+import panels
+
+# Record how long the app's own imports took when this process started;
+# matplotlib and Plotly are imported by the first chart drawn
+instrumentation.import_timings.setdefault('app', time.perf_counter() - import_start)
+
+# Measure the peak memory of each stage when ETSY_APP_TRACE_MEMORY=1 (slows the app down);
+# tracing is process-wide, so it is set for the whole server, never stopped by a session
+if os.environ.get('ETSY_APP_TRACE_MEMORY') == '1' and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+# Record the time spent in each stage of this run
+timing_records = instrumentation.start_recording()
 
 # Use a with statement to create the sidebar
 with st.sidebar:
     # Add a title to the sidebar
     st.title("Welcome to My App")
 
+    # Add a checkbox for exports too large to hold in memory
+    streaming_mode = st.checkbox("Streaming mode for large files", help="Reads the upload in chunks and keeps only the aggregates in memory.")
+
 container1 = st.container()
 container2 = st.container()
 container3 = st.container()
@@ -16,6 +41,8 @@ container4 = st.container()
 container5 = st.container()
 container6 = st.container()
 container7 = st.container()
+container8 = st.container()
+container9 = st.container()
 
 # Open the file and read its contents
 with open('text1.txt', 'r') as f:
@@ -26,45 +53,62 @@ with container1:
     st.title("Etsy Orders Data Analysis App")
     st.write(text) 
 
-    # Create upload button
-    uploaded_file = st.file_uploader("Upload a CSV file", type="csv")
+    # Create upload button, accepting several exports (such as one per year)
+    uploaded_files = st.file_uploader("Upload CSV files", type="csv", accept_multiple_files=True)
       
 with container2:
+    # The aggregates of streaming mode, which stand in for the orders
+    streamed = None
+
     # If no file was uploaded
-    if uploaded_file is None:
-        # Read the CSV file and store it as a DataFrame
-        df = pd.read_csv('EtsySoldOrders2022_masked.csv')
+    if not uploaded_files:
+        # Read the sample CSV file (parsed once and cached across reruns)
+        df = ingestion.load_sample_data()
         
         # If no file is uploaded, show a message that sample data is being used
         st.warning("No file uploaded. Using sample data.")
+    elif streaming_mode:
+        # Aggregate the uploaded file chunk by chunk, keeping only a preview of the orders
+        streamed = aggregations.aggregate_orders_in_chunks([f.getvalue() for f in uploaded_files])
+        df = streamed.preview
+        st.info("Streaming mode: only the first orders are kept for display.")
     else: 
-        # Load file into dataframe
-        df = pd.read_csv(uploaded_file)
-        
-        # List of column names to mask
-        col_names = ['Buyer User ID', 'Full Name', 'First Name', 'Last Name', 'Buyer']
-        
-        # Mask the data
-        df = my_functions.mask_names_inplace(df, col_names)
+        # Load and mask the uploaded files in parallel and combine them (cached by the hash of their contents)
+        df = ingestion.load_uploaded_files(uploaded_files)
     
+# Compute each panel only when it is shown, once per dataset (the sales cube is built in container4)
+page = panels.PanelPage(
+    df, sales_cube=lambda: aggregations.get_sales_cube(df) if sales_cube is None else sales_cube,
+    daily_revenue=lambda: aggregations.get_daily_revenue(df) if streamed is None else streamed.daily_revenue,
+    latency_cube=lambda: aggregations.get_latency_cube(df) if streamed is None else streamed.latency_cube,
+    sku_index=lambda: aggregations.get_sku_index(df) if streamed is None else streamed.sku_index,
+    cohort_table=lambda: aggregations.get_cohort_table(df) if streamed is None else streamed.cohort_table,
+    date_range=lambda: (start_date, end_date))
+
 with container3:
-    # Create a checkbox that toggles the display of the entire DataFrame
-    if st.checkbox("Check to display the entire DataFrame."):
-        st.write(df)
-    else:
+    # Create a checkbox that toggles the display of the entire DataFrame, a page of orders at a time
+    if not page.expander("Check to display the entire DataFrame.", panels.ORDERS_PANEL):
         st.write(df.head())
         
 with container4:
     # Create a header
     st.header("Daily Quantity of Items Sold")
     
-    # Preparing the Data for Plotting
+    # Preparing the Data for Plotting (a no-op when the loader already added the date columns)
     my_functions.add_date_columns(df, 'Sale Date')
-    grouped_df = my_functions.get_clean_sales_data_by_date(df)
+
+    # Summarize the orders once into a daily x state x country cube shared by all panels;
+    # with the SQL backend switched on, the daily sales and states are queried instead
+    # and the cube is only built for the panels that need it
+    if streamed is None:
+        sales_cube = None if my_functions.use_sql_backend() else aggregations.get_sales_cube(df)
+    else:
+        sales_cube = streamed.sales_cube
+    grouped_df = aggregations.get_daily_sales(df, sales_cube)
     
-    # Get the minimum and maximum dates from the "Date" column of the DataFrame
-    min_date = pd.to_datetime(grouped_df['Date']).min()
-    max_date = pd.to_datetime(grouped_df['Date']).max()
+    # Get the minimum and maximum dates from the sorted date index of the DataFrame
+    min_date = grouped_df.index[0]
+    max_date = grouped_df.index[-1]
     
     # Set the default start date to the minimum date and the default end date to the maximum date
     default_start_date = min_date.date()
@@ -83,30 +127,19 @@ with container4:
 
     filtered_df = my_functions.filter_dataframe_by_date(grouped_df, start_date, end_date)
     
-    my_functions.plot_line_chart_plotly(filtered_df, 'Date', 'Total Quantity Sold')
+    # Sum long date ranges into weekly or monthly points so the chart stays light
+    my_functions.plot_line_chart_plotly(filtered_df, 'Date', 'Total Quantity Sold', resolution='auto')
+
+    # Show the days from sale to shipment of the orders sold in the same date range
+    page.expander("Show fulfillment latency", panels.FULFILLMENT_PANEL, expanded=True)
 
         
 with container5:
     # Create a header
     st.header("Number of Sold Items Plots")
     
-    # Create two tabs
-    tabs = st.tabs(["Number of Sold Items by Month", "Number of Sold Items by Weekend/Weekday"])
-
-    # Add content to the tabs
-    with tabs[0]:
-        # Create new columns for sale_date_datetime, year, month, day, day_of_week, and is_weekend
-        my_functions.add_date_columns(df, 'Sale Date')
-
-        # Call the function to calculate the monthly sum and fill missing months with zero
-        df_monthly_sum = my_functions.calculate_monthly_sum(df)
-
-        # Plot the monthly sales
-        my_functions.plot_monthly_sales(df_monthly_sum)
-
-    with tabs[1]:
-        # plot number of sales by Weekend/Weekday
-        my_functions.plot_sales_by_weekday_weekend(df)
+    # Show a choice between the monthly and the Weekend/Weekday plots, computing only the chosen one
+    page.tabs([panels.MONTHLY_SALES_PANEL, panels.WEEKDAY_WEEKEND_PANEL])
         
 with container6:
     
@@ -119,7 +152,39 @@ with container6:
     # Display the selected value
     st.write("You selected:", slider_value)
     
-    orders_by_state = my_functions.get_orders_by_state(df)
-    orders_by_state = my_functions.clean_orders_by_state(orders_by_state)
-    grouped_orders = my_functions.group_orders_by_state(orders_by_state, slider_value)
-    my_functions.plot_orders_by_state_bar_with_percentage(grouped_orders)
\ No newline at end of file
+    # Rank the states once per dataset, so moving the slider only slices the ranking
+    ranked_states = aggregations.get_ranked_states(df, sales_cube, None if streamed is None else streamed.orders_by_state)
+    grouped_orders = aggregations.group_ranked_orders_by_state(ranked_states, slider_value)
+    page.chart(my_functions.make_orders_by_state_bar_with_percentage_figure, grouped_orders)
+
+with container7:
+    # Add a header to the container
+    st.header("Revenue and Fees by Month")
+
+    # Show one money metric at a time, all derived from the same daily sums
+    page.tabs(panels.REVENUE_PANELS, key='revenue_metric')
+
+with container8:
+    # Add a header to the container
+    st.header("Top Products")
+
+    # Rank the SKUs sold in the date range chosen above
+    page.show(panels.TOP_PRODUCTS_PANEL)
+
+with container9:
+    # Add a header to the container
+    st.header("Repeat Buyers by First Purchase Month")
+    if not uploaded_files:
+        st.caption("The buyer ids of the sample data were masked before it was published, so different buyers may be counted as one.")
+
+    # Show the share of each month's new buyers who came back in the following months (in percent)
+    page.expander("Show cohorts", panels.COHORTS_PANEL, expanded=True)
+
+# Render the plots of the shown panels in parallel and show them in their places
+page.render_charts()
+
+# Show where the time of this run went, and log it when ETSY_APP_TIMINGS_LOG names a file
+instrumentation.stop_recording()
+instrumentation.show_timings_panel(timing_records)
+if os.environ.get('ETSY_APP_TIMINGS_LOG'):
+    instrumentation.dump_jsonl(timing_records, os.environ['ETSY_APP_TIMINGS_LOG'], timestamp=time.time())
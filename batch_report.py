@@ -0,0 +1,165 @@
+"""
+Writes the charts and aggregate tables of the app for many shops at once,
+without Streamlit, so that reports can be precomputed off the interactive
+server.
+
+Each CSV file of the input directory is the export of one shop, and each
+subdirectory holds the exports of one shop, which are combined as when they
+are uploaded together. Run it from the repository root:
+
+    python batch_report.py exports/ reports/ --workers 4
+
+The report of each shop is written to a directory of the same name in the
+output directory.
+"""
+
+# Import libraries
+
+import argparse
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import matplotlib
+
+import aggregations
+import cohorts
+import fulfillment
+import ingestion
+import my_functions
+import rendering
+import revenue
+import sku_index
+
+# Define functions
+
+def find_shops(input_dir):
+    """
+    Returns the shops of the input directory as a dict mapping each shop name
+    to the sorted paths of its exports.
+    """
+    shops = {}
+    for entry in sorted(os.listdir(input_dir)):
+        path = os.path.join(input_dir, entry)
+        if os.path.isdir(path):
+            paths = sorted(glob.glob(os.path.join(path, '*.csv')))
+            if paths:
+                shops[entry] = paths
+        elif entry.lower().endswith('.csv'):
+            shops[os.path.splitext(entry)[0]] = [path]
+    return shops
+
+def _init_worker():
+    # Render off-screen in the worker processes
+    matplotlib.use('Agg')
+
+def write_report(name, paths, output_dir, fmt='png', top_n=10, mask=True):
+    """
+    Runs the pipeline of the app over the exports of one shop and writes its
+    aggregate tables as CSV files, its matplotlib charts as PNG or SVG images
+    and its daily sales as an interactive Plotly HTML file.
+
+    Parameters:
+        name (str): The name of the shop, used as the name of its report
+        directory.
+        paths (list): The paths of the shop's exports.
+        output_dir (str): The directory the report directory is created in.
+        fmt (str): The image format of the charts, 'png' or 'svg'.
+        top_n (int): The number of states shown in the top states chart.
+        mask (bool): Whether to mask the buyer names.
+
+    Returns:
+        tuple: The name of the shop and the number of orders in its report.
+    """
+    # Parse the exports without the app's caches, which only help reruns
+    frames = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            frames.append(ingestion.parse_orders(f.read(), mask=mask))
+    df = frames[0] if len(frames) == 1 else ingestion.concat_orders(frames)
+
+    # Compute every table from a single pass over the orders
+    cube = aggregations.build_sales_cube(df)
+    daily = aggregations.daily_sales_from_cube(cube)
+    if aggregations.spans_several_years(cube):
+        monthly = aggregations.year_month_sum_from_cube(cube)
+    else:
+        monthly = aggregations.monthly_sum_from_cube(cube)
+    weekday_weekend = aggregations.weekday_weekend_from_cube(cube)
+    ranked = aggregations.rank_orders_by_state(
+        my_functions.clean_orders_by_state(aggregations.orders_by_state_from_cube(cube)))
+    top_states = aggregations.group_ranked_orders_by_state(ranked, top_n)
+    monthly_revenue = revenue.monthly_revenue(revenue.build_daily_revenue(df)).reset_index()
+    latency_cube = fulfillment.build_latency_cube(df)
+    top_products = sku_index.top_skus(sku_index.build_sku_index(df), top_n)
+    buyer_cohorts = cohorts.cohort_table(cohorts.build_buyer_months(df)).reset_index()
+    latency_by_week = fulfillment.latency_percentiles(fulfillment.latency_histogram(latency_cube)).reset_index()
+    latency_by_state = fulfillment.latency_percentiles(
+        fulfillment.latency_histogram(latency_cube, by='Ship State')).reset_index()
+
+    report_dir = os.path.join(output_dir, name)
+    os.makedirs(report_dir, exist_ok=True)
+
+    # Label the weekday and weekend rows, which are indexed by is_weekend
+    weekday_weekend_table = weekday_weekend.rename(index={False: 'Weekday', True: 'Weekend'}).rename_axis('Day Type').reset_index()
+
+    tables = {'daily_sales': daily, 'monthly_sales': monthly, 'weekday_weekend': weekday_weekend_table,
+              'orders_by_state': ranked, 'monthly_revenue': monthly_revenue, 'latency_by_week': latency_by_week,
+              'latency_by_state': latency_by_state, 'top_products': top_products, 'cohorts': buyer_cohorts}
+    for table_name, table in tables.items():
+        table.to_csv(os.path.join(report_dir, table_name + '.csv'), index=False, float_format='%.2f')
+
+    charts = {
+        'monthly_sales': (my_functions.make_monthly_sales_figure, monthly),
+        'weekday_weekend': (my_functions.make_sales_by_weekday_weekend_figure, weekday_weekend),
+        'top_states': (my_functions.make_orders_by_state_bar_with_percentage_figure, top_states),
+    }
+    for chart_name, (make_figure, chart_data) in charts.items():
+        with open(os.path.join(report_dir, f'{chart_name}.{fmt}'), 'wb') as f:
+            f.write(rendering.render_figure(make_figure(chart_data), fmt=fmt))
+
+    fig = my_functions.make_line_chart_figure(daily, 'Date', 'Total Quantity Sold', resolution='auto')
+    fig.write_html(os.path.join(report_dir, 'daily_sales.html'), include_plotlyjs='cdn')
+
+    return name, len(df)
+
+def write_reports(input_dir, output_dir, workers=None, fmt='png', top_n=10, mask=True):
+    """
+    Writes the report of every shop of the input directory, one shop per
+    worker process. A shop whose exports cannot be read is reported and
+    skipped. Returns the names of the shops that failed.
+    """
+    shops = find_shops(input_dir)
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        futures = {executor.submit(write_report, name, paths, output_dir, fmt, top_n, mask): name
+                   for name, paths in shops.items()}
+        for future in as_completed(futures):
+            try:
+                name, n_orders = future.result()
+                print(f'{name}: {n_orders} orders')
+            except Exception as error:
+                failed.append(futures[future])
+                print(f'{futures[future]}: failed ({error})')
+    return sorted(failed)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('input_dir')
+    parser.add_argument('output_dir')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes, one per CPU by default')
+    parser.add_argument('--format', choices=['png', 'svg'], default='png', help='image format of the charts')
+    parser.add_argument('--top-n', type=int, default=10, help='number of states in the top states chart')
+    parser.add_argument('--no-mask', action='store_true', help='keep the buyer names unmasked')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    failed = write_reports(args.input_dir, args.output_dir, workers=args.workers, fmt=args.format,
+                           top_n=args.top_n, mask=not args.no_mask)
+    print(f'Done in {time.perf_counter() - start:.1f} s')
+    if failed:
+        raise SystemExit(f'Failed: {", ".join(failed)}')
+
+if __name__ == '__main__':
+    main()
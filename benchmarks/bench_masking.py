@@ -0,0 +1,93 @@
+"""
+Compares my_functions.mask_names_inplace with the previous per-cell
+implementation on synthetic Etsy exports.
+
+Run it from the repository root:
+
+    python -m benchmarks.bench_masking
+"""
+
+# Import libraries
+
+import argparse
+import copy
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+import my_functions
+
+# List of column names to mask
+COL_NAMES = ['Buyer User ID', 'Full Name', 'First Name', 'Last Name', 'Buyer']
+
+# Define functions
+
+def legacy_mask_names_inplace(df, col_names):
+    # The per-cell implementation that mask_names_inplace replaced
+    df_copy = copy.deepcopy(df)
+    regex = re.compile(r'\B\w')
+    for col_name in col_names:
+        df_copy.loc[:, col_name] = df_copy[col_name].apply(lambda name:
+            regex.sub('*', str(name)) if isinstance(name, str) else np.nan)
+    return df_copy
+
+def make_buyer_columns(n_rows, repeat_rate=3, seed=0):
+    """
+    Returns a DataFrame with the buyer name columns of an Etsy export, where
+    each buyer places repeat_rate orders on average.
+    """
+    rng = np.random.default_rng(seed)
+    n_buyers = max(1, n_rows // repeat_rate)
+
+    # Build a pool of buyers from common first and last names and draw one
+    # buyer per order
+    first = np.array([f'First{i}' for i in rng.integers(0, 2000, n_buyers)], dtype=object)
+    last = np.array([f'Last{i}' for i in rng.integers(0, 20000, n_buyers)], dtype=object)
+    buyer = rng.integers(0, n_buyers, n_rows)
+
+    df = pd.DataFrame({
+        'Buyer User ID': np.array([f'user{i}' for i in range(n_buyers)], dtype=object)[buyer],
+        'Full Name': first[buyer] + ' ' + last[buyer],
+        'First Name': first[buyer],
+        'Last Name': last[buyer],
+        'Number of Items': rng.integers(1, 4, n_rows),
+    })
+    df['Buyer'] = df['Full Name']
+
+    # Guest checkouts have no Buyer User ID
+    df.loc[rng.random(n_rows) < 0.2, 'Buyer User ID'] = np.nan
+
+    return df
+
+def time_call(func, *args, repeat=3):
+    # Return the best wall time of repeat calls
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f'{"rows":>10} {"legacy (s)":>12} {"vectorized (s)":>15} {"speedup":>8}')
+    for n_rows in args.rows:
+        df = make_buyer_columns(n_rows)
+
+        # Both implementations must produce the same values
+        expected = legacy_mask_names_inplace(df, COL_NAMES)
+        actual = my_functions.mask_names_inplace(df, COL_NAMES)
+        pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+        legacy = time_call(legacy_mask_names_inplace, df, COL_NAMES, repeat=args.repeat)
+        vectorized = time_call(my_functions.mask_names_inplace, df, COL_NAMES, repeat=args.repeat)
+        print(f'{n_rows:>10} {legacy:>12.3f} {vectorized:>15.3f} {legacy / vectorized:>7.1f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+"""
+Times the public functions of the app and its end-to-end pipeline on
+synthetic Etsy exports, without Streamlit's server.
+
+Run it from the repository root:
+
+    python -m benchmarks.run_benchmarks --rows 10000 100000 1000000
+
+Each run appends one JSON line per function and size to the results file,
+tagged with a run id, the git commit and the library versions, and --compare
+prints the change against the previous run of the same file.
+"""
+
+# Import libraries
+
+import argparse
+import functools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+
+import matplotlib
+import numpy as np
+import pandas as pd
+
+import aggregations
+import cohorts
+import etsy_schema
+import fulfillment
+import ingestion
+import my_functions
+import rendering
+import revenue
+import sku_index
+import sql_backend
+from benchmarks import synthetic
+
+# Default file the results are appended to
+RESULTS_PATH = os.path.join('benchmarks', 'results.jsonl')
+
+# Define classes
+
+class Fixtures:
+    """
+    The inputs of the timed functions for one synthetic export, each built
+    the first time a case uses it, so that a run filtered to a few cases
+    only holds their inputs in memory.
+
+    Parameters:
+        path (str): The path of the synthetic export.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    @functools.cached_property
+    def raw(self):
+        # The orders as read, before masking and date features
+        return etsy_schema.read_orders_csv(self.path, columns=etsy_schema.APP_COLUMNS)
+
+    @functools.cached_property
+    def df(self):
+        # The orders as the app holds them, masked and pseudonymized by
+        # ingestion.prepare_orders, read again so that raw stays untouched
+        return ingestion.prepare_orders(etsy_schema.read_orders_csv(self.path, columns=etsy_schema.APP_COLUMNS))
+
+    @functools.cached_property
+    def cube(self):
+        return aggregations.build_sales_cube(self.df)
+
+    @functools.cached_property
+    def daily(self):
+        return my_functions.get_clean_sales_data_by_date(self.df)
+
+    @functools.cached_property
+    def indexed_daily(self):
+        return my_functions.index_by_date(self.daily)
+
+    @functools.cached_property
+    def date_range(self):
+        # The middle half of the days with sales
+        return self.daily['Date'].iloc[len(self.daily) // 4], self.daily['Date'].iloc[3 * len(self.daily) // 4]
+
+    @functools.cached_property
+    def orders_by_state(self):
+        return my_functions.clean_orders_by_state(my_functions.get_orders_by_state(self.df))
+
+    @functools.cached_property
+    def ranked(self):
+        return aggregations.rank_orders_by_state(self.orders_by_state)
+
+# Define functions
+
+def time_call(func, repeat):
+    # Return the wall times of repeat calls
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+def run_pipeline(path):
+    """
+    Runs what the app computes for a freshly uploaded export, without any
+    cache: parsing, masking, date features, the aggregates of every panel and
+    the rendering of the matplotlib charts.
+    """
+    df = ingestion.prepare_orders(etsy_schema.read_orders_csv(path, columns=etsy_schema.APP_COLUMNS))
+    cube = aggregations.build_sales_cube(df)
+    daily = my_functions.index_by_date(aggregations.daily_sales_from_cube(cube))
+    my_functions.filter_dataframe_by_date(daily, daily.index[0], daily.index[-1])
+    ranked = aggregations.rank_orders_by_state(
+        my_functions.clean_orders_by_state(aggregations.orders_by_state_from_cube(cube)))
+    charts = [
+        (my_functions.make_monthly_sales_figure, aggregations.monthly_sum_from_cube(cube)),
+        (my_functions.make_sales_by_weekday_weekend_figure, aggregations.weekday_weekend_from_cube(cube)),
+        (my_functions.make_orders_by_state_bar_with_percentage_figure,
+         aggregations.group_ranked_orders_by_state(ranked, 10)),
+    ]
+    for make_figure, chart_data in charts:
+        rendering.render_figure(make_figure(chart_data))
+
+def run_sql_queries(df):
+    # Register the orders in a new database and run every query once, without
+    # the per-dataset caches
+    database = sql_backend.OrdersDatabase(df)
+    for sql in sql_backend.QUERIES.values():
+        database.query(sql)
+
+def make_cases(path):
+    """
+    Returns the Fixtures of one synthetic export and the (name, fixtures,
+    function) triples timed for it, where fixtures names the fixtures the
+    function uses, to be built before it is timed.
+    """
+    fx = Fixtures(path)
+    cases = [
+        ('read_orders_csv', (), lambda: etsy_schema.read_orders_csv(path, columns=etsy_schema.APP_COLUMNS)),
+        ('read_orders_csv[all columns]', (), lambda: etsy_schema.read_orders_csv(path)),
+        ('mask_names_inplace', ('raw',), lambda: my_functions.mask_names_inplace(fx.raw, etsy_schema.NAME_COLUMNS)),
+        ('add_date_columns', ('raw',), lambda: my_functions.add_date_columns(fx.raw.copy(deep=False), 'Sale Date')),
+        ('calculate_monthly_sum', ('df',), lambda: my_functions.calculate_monthly_sum(fx.df)),
+        ('calculate_year_month_sum', ('df',), lambda: my_functions.calculate_year_month_sum(fx.df)),
+        ('get_sales_by_weekday_weekend', ('df',), lambda: my_functions.get_sales_by_weekday_weekend(fx.df)),
+        ('get_clean_sales_data_by_date', ('df',), lambda: my_functions.get_clean_sales_data_by_date(fx.df)),
+        ('get_orders_by_state', ('df',), lambda: my_functions.get_orders_by_state(fx.df)),
+        ('group_orders_by_state', ('orders_by_state',),
+         lambda: my_functions.group_orders_by_state(fx.orders_by_state, 10)),
+        ('group_ranked_orders_by_state', ('ranked',), lambda: aggregations.group_ranked_orders_by_state(fx.ranked, 10)),
+        ('filter_dataframe_by_date', ('daily', 'date_range'),
+         lambda: my_functions.filter_dataframe_by_date(fx.daily, *fx.date_range)),
+        ('filter_dataframe_by_date[indexed]', ('indexed_daily', 'date_range'),
+         lambda: my_functions.filter_dataframe_by_date(fx.indexed_daily, *fx.date_range)),
+        ('build_sales_cube', ('df',), lambda: aggregations.build_sales_cube(fx.df)),
+        ('cube views', ('cube',),
+         lambda: (aggregations.daily_sales_from_cube(fx.cube), aggregations.monthly_sum_from_cube(fx.cube),
+                  aggregations.weekday_weekend_from_cube(fx.cube), aggregations.orders_by_state_from_cube(fx.cube))),
+        ('count_orders_by_state', ('df',), lambda: aggregations.count_orders_by_state(fx.df)),
+        ('build_daily_revenue', ('df',), lambda: revenue.build_daily_revenue(fx.df)),
+        ('build_latency_cube', ('df',), lambda: fulfillment.build_latency_cube(fx.df)),
+        ('build_sku_index', ('df',), lambda: sku_index.build_sku_index(fx.df)),
+        ('cohort_table', ('df',), lambda: cohorts.cohort_table(cohorts.build_buyer_months(fx.df))),
+        ('sql_backend', ('df',), lambda: run_sql_queries(fx.df)),
+        ('make_monthly_sales_figure+render', ('df',),
+         lambda: rendering.render_figure(my_functions.make_monthly_sales_figure(my_functions.calculate_monthly_sum(fx.df)))),
+        ('make_orders_by_state_bar_with_percentage_figure+render', ('ranked',),
+         lambda: rendering.render_figure(my_functions.make_orders_by_state_bar_with_percentage_figure(
+             aggregations.group_ranked_orders_by_state(fx.ranked, 56)))),
+        ('end-to-end pipeline', (), lambda: run_pipeline(path)),
+    ]
+    if etsy_schema.has_pyarrow():
+        cases.insert(1, ('read_orders_csv[pyarrow]', (), lambda: etsy_schema.read_orders_csv(
+            path, columns=etsy_schema.APP_COLUMNS, engine='pyarrow')))
+    return fx, cases
+
+def git_commit():
+    # Return the short hash of the checked out commit, if any
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def load_previous_run(path, run_id):
+    """
+    Returns the results of the latest run in the results file other than
+    run_id, keyed by (function, rows).
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        results = [json.loads(line) for line in f if line.strip()]
+    previous_ids = sorted({result['run_id'] for result in results if result['run_id'] != run_id})
+    if not previous_ids:
+        return {}
+    return {(result['function'], result['rows']): result for result in results if result['run_id'] == previous_ids[-1]}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--years', type=int, default=1, help='number of years the synthetic orders span')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--filter', default='', help='only time the functions whose name contains this text')
+    parser.add_argument('--output', default=RESULTS_PATH)
+    parser.add_argument('--compare', action='store_true', help='print the change against the previous run')
+    args = parser.parse_args()
+
+    matplotlib.use('Agg')
+    run_id = time.strftime('%Y%m%dT%H%M%S')
+    metadata = {
+        'run_id': run_id,
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'sql_engine': sql_backend.available_engine(),
+        'cpu_count': os.cpu_count(),
+    }
+    previous = load_previous_run(args.output, run_id) if args.compare else {}
+
+    print(f'{"function":<56} {"rows":>10} {"best (s)":>10} {"median (s)":>11}' + (f' {"vs prev":>8}' if args.compare else ''))
+    with open(args.output, 'a') as f, tempfile.TemporaryDirectory() as tmp_dir:
+        for n_rows in args.rows:
+            # Write the export to disk a chunk at a time, so that even 10M
+            # rows never have to be held in memory as text
+            path = os.path.join(tmp_dir, f'orders_{n_rows}.csv')
+            synthetic.write_export(path, n_rows, n_years=args.years)
+            fx, cases = make_cases(path)
+            for name, fixtures, func in cases:
+                if args.filter not in name:
+                    continue
+                # Build the inputs of the case outside of its timings
+                for fixture in fixtures:
+                    getattr(fx, fixture)
+                times = time_call(func, args.repeat)
+                result = {**metadata, 'function': name, 'rows': n_rows, 'years': args.years,
+                          'best_s': min(times), 'median_s': statistics.median(times), 'times_s': times}
+                f.write(json.dumps(result) + '\n')
+
+                line = f'{name:<56} {n_rows:>10} {result["best_s"]:>10.4f} {result["median_s"]:>11.4f}'
+                if (name, n_rows) in previous:
+                    line += f' {result["best_s"] / previous[(name, n_rows)]["best_s"]:>7.2f}x'
+                print(line, flush=True)
+            del fx, cases
+            os.remove(path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Generates synthetic Etsy "Sold Orders" exports for benchmarking.
+
+The orders are drawn from the sample dataset, so that the joint distribution
+of states, countries, items, money columns, SKUs and shipping delays matches
+a real shop, with new Order IDs, buyers and sale dates spread over the
+requested years. Write a 1M-row export from the repository root with:
+
+    python -m benchmarks.synthetic 1000000 orders_1m.csv
+"""
+
+# Import libraries
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import etsy_schema
+
+# Path of the sample dataset the distributions are drawn from
+SAMPLE_PATH = 'EtsySoldOrders2022_masked.csv'
+
+# Define functions
+
+def load_sample(path=SAMPLE_PATH):
+    """
+    Returns the sample export with every column read as text, as it appears
+    in the CSV file.
+    """
+    return pd.read_csv(path, dtype=str, keep_default_na=False)
+
+def make_orders(n_rows, n_years=1, last_year=2022, buyers_per_order=0.85, seed=0, sample=None, first_order_id=1_000_000_000):
+    """
+    Returns a synthetic export of n_rows orders as text columns in the layout
+    of the Etsy "Sold Orders" CSV, newest orders first.
+
+    Parameters:
+        n_rows (int): The number of orders.
+        n_years (int): The number of years the sale dates span, ending with
+        last_year. The day-of-year profile of the sample is kept. Defaults to 1.
+        last_year (int): The year of the most recent orders. Defaults to 2022.
+        buyers_per_order (float): The number of distinct buyers per order,
+        0.85 in the sample. Defaults to 0.85.
+        seed (int): The seed of the random generator. Defaults to 0.
+        sample (pandas.DataFrame): The output of load_sample, to avoid reading
+        it again when generating several exports.
+        first_order_id (int): The smallest Order ID. Defaults to 1e9.
+
+    Returns:
+        pandas.DataFrame: The synthetic orders.
+    """
+    rng = np.random.default_rng(seed)
+    sample = load_sample() if sample is None else sample
+
+    # Draw whole rows, keeping the joint distribution of the other columns
+    df = sample.iloc[rng.integers(0, len(sample), n_rows)].reset_index(drop=True)
+
+    # Move each sale to a random year, keeping its day of the year, and keep
+    # the delay until it was shipped
+    sale_dates = pd.to_datetime(df['Sale Date'], format=etsy_schema.DATE_FORMAT)
+    shipped_dates = pd.to_datetime(df['Date Shipped'], format=etsy_schema.DATE_FORMAT, errors='coerce')
+    year_shift = pd.to_timedelta((last_year - sale_dates.dt.year + rng.integers(1 - n_years, 1, n_rows)) * 365, unit='D')
+    sale_dates = sale_dates + year_shift
+    shipped_dates = shipped_dates + year_shift
+
+    # Sort the orders newest first, like the Etsy export
+    order = np.argsort(-sale_dates.to_numpy().astype('int64'), kind='stable')
+    df = df.iloc[order].reset_index(drop=True)
+    sale_dates = sale_dates.iloc[order].reset_index(drop=True)
+    shipped_dates = shipped_dates.iloc[order].reset_index(drop=True)
+    df['Sale Date'] = sale_dates.dt.strftime(etsy_schema.DATE_FORMAT)
+    df['Date Shipped'] = shipped_dates.dt.strftime(etsy_schema.DATE_FORMAT).fillna('')
+
+    # Give every order a new id, increasing with its sale date
+    df['Order ID'] = (first_order_id + np.arange(n_rows)[::-1]).astype(str)
+
+    # Draw the buyers from a pool, so that some of them order repeatedly
+    n_buyers = max(1, int(n_rows * buyers_per_order))
+    buyer = rng.integers(0, n_buyers, n_rows)
+    first_names = np.array([f'First{i}' for i in range(2000)], dtype=object)[rng.integers(0, 2000, n_buyers)]
+    last_names = np.array([f'Last{i}' for i in range(20000)], dtype=object)[rng.integers(0, 20000, n_buyers)]
+    df['First Name'] = first_names[buyer]
+    df['Last Name'] = last_names[buyer]
+    df['Full Name'] = df['First Name'] + ' ' + df['Last Name']
+    df['Buyer'] = df['Full Name']
+
+    # Guest checkouts have no Buyer User ID, about one order in ten in the sample
+    user_ids = np.array([f'user{i}' for i in range(n_buyers)], dtype=object)[buyer]
+    user_ids[rng.random(n_rows) < 0.11] = ''
+    df['Buyer User ID'] = user_ids
+
+    return df
+
+def write_export(path, n_rows, chunksize=500_000, seed=0, **kwargs):
+    """
+    Writes a synthetic export of n_rows orders to path, generating at most
+    chunksize orders at a time so that exports of tens of millions of orders
+    fit in memory. The orders are sorted newest first within each chunk.
+    """
+    sample = load_sample()
+    with open(path, 'w', newline='') as f:
+        for i, start in enumerate(range(0, n_rows, chunksize)):
+            chunk = make_orders(min(chunksize, n_rows - start), seed=seed + i, sample=sample,
+                                first_order_id=1_000_000_000 + start, **kwargs)
+            chunk.to_csv(f, index=False, header=(i == 0))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('rows', type=int)
+    parser.add_argument('path')
+    parser.add_argument('--years', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    write_export(args.path, args.rows, seed=args.seed, n_years=args.years)
+
+if __name__ == '__main__':
+    main()
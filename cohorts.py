@@ -0,0 +1,139 @@
+# Import libraries
+
+import numpy as np
+import pandas as pd
+
+import etsy_schema
+import instrumentation
+
+# Define functions
+
+def _month_numbers(df):
+    # Months since year 0 of the sale dates, from the date features of
+    # add_date_columns, and whether each sale date is present
+    years = df['year'].to_numpy(dtype=np.float64, na_value=np.nan)
+    months = df['month'].to_numpy(dtype=np.float64, na_value=np.nan)
+    has_date = ~np.isnan(years)
+    return np.where(has_date, years * 12 + months - 1, 0).astype(np.int32), has_date
+
+def _group_starts(sorted_values):
+    # Positions where a new group of equal values starts in a sorted array,
+    # none for an empty array
+    if len(sorted_values) == 0:
+        return np.empty(0, dtype=np.intp)
+    return np.flatnonzero(np.r_[True, sorted_values[1:] != sorted_values[:-1]])
+
+def _buyer_months_from_entries(buyers, months, orders):
+    # Sum the orders of each (buyer, month) pair, sorted by buyer and month
+    codes, labels = pd.factorize(buyers)
+    keys = (codes.astype(np.int64) << 32) | months.astype(np.int64)
+    order = np.argsort(keys, kind='stable')
+    keys, orders = keys[order], orders[order]
+    starts = _group_starts(keys)
+
+    return pd.DataFrame({
+        'Buyer': pd.Categorical.from_codes((keys[starts] >> 32).astype(np.int32), categories=labels),
+        'Month': (keys[starts] & 0xFFFFFFFF).astype(np.int32),
+        'Orders': np.add.reduceat(orders, starts).astype(np.int32) if len(starts) else np.empty(0, dtype=np.int32),
+    })
+
+@instrumentation.timed()
+def build_buyer_months(df):
+    """
+    Counts the orders of each buyer in each month: the compact summary the
+    cohort tables are computed from, which can be merged across chunks.
+
+    Parameters:
+        df (pandas.DataFrame): A DataFrame containing order data, with the
+        'year' and 'month' columns of add_date_columns and the buyer ids
+        (pseudonymized by ingestion.prepare_orders). Orders without buyer id,
+        such as guest checkouts, or without sale date are left out.
+
+    Returns:
+        pandas.DataFrame: One row per (Buyer, Month) with orders, sorted by
+        buyer and month, with the categorical column 'Buyer', the month as a
+        number of months since year 0 in 'Month' and the number of orders in
+        'Orders'.
+    """
+    buyers = df[etsy_schema.BUYER_ID_COLUMN]
+    months, has_date = _month_numbers(df)
+    has_buyer = (buyers.notna() & (buyers != '')).to_numpy() & has_date
+    return _buyer_months_from_entries(buyers.to_numpy(dtype=object)[has_buyer], months[has_buyer],
+                                      np.ones(has_buyer.sum(), dtype=np.int64))
+
+def merge_buyer_months(parts):
+    """
+    Adds buyer months built from separate parts of the orders (such as the
+    chunks of a large export) into the buyer months of all the orders.
+    """
+    return _buyer_months_from_entries(
+        np.concatenate([part['Buyer'].astype(object).to_numpy() for part in parts]),
+        np.concatenate([part['Month'].to_numpy() for part in parts]),
+        np.concatenate([part['Orders'].to_numpy(dtype=np.int64) for part in parts]))
+
+@instrumentation.timed()
+def cohort_table(buyer_months):
+    """
+    Groups the buyers by the month of their first purchase and counts, for
+    each cohort, its buyers, those who ordered more than once, and the buyers
+    active 0, 1, 2, ... months after their first purchase. The groups are
+    read off the boundaries of the sorted buyer months, without groupby.
+
+    Parameters:
+        buyer_months (pandas.DataFrame): The output of build_buyer_months.
+
+    Returns:
+        pandas.DataFrame: One row per cohort, indexed by its first month
+        ('YYYY-MM'), with columns 'Buyers', 'Repeat Buyers', 'Repeat Rate'
+        and the number of active buyers for each month offset 0, 1, 2, ...
+    """
+    buyers = buyer_months['Buyer'].cat.codes.to_numpy()
+    months = buyer_months['Month'].to_numpy()
+    orders = buyer_months['Orders'].to_numpy()
+    if len(buyers) == 0:
+        return pd.DataFrame(columns=['Buyers', 'Repeat Buyers', 'Repeat Rate', 0], index=pd.Index([], name='Cohort'))
+
+    # The rows of each buyer are contiguous and sorted by month, so the first
+    # row of each buyer holds their first month
+    starts = _group_starts(buyers)
+    n_months = np.diff(np.r_[starts, len(buyers)])
+    first_months = months[starts]
+    offsets = months - np.repeat(first_months, n_months)
+    is_repeat = np.add.reduceat(orders, starts) > 1
+
+    # Count the buyers of each (cohort, offset) cell at once
+    cohort_months, buyer_cohorts = np.unique(first_months, return_inverse=True)
+    buyer_cohorts = buyer_cohorts.ravel()
+    n_offsets = int(offsets.max()) + 1
+    active = np.bincount(np.repeat(buyer_cohorts, n_months) * n_offsets + offsets,
+                         minlength=len(cohort_months) * n_offsets).reshape(len(cohort_months), n_offsets)
+    n_buyers = np.bincount(buyer_cohorts, minlength=len(cohort_months))
+    n_repeat = np.bincount(buyer_cohorts, weights=is_repeat, minlength=len(cohort_months)).astype(np.int64)
+
+    labels = pd.Index([f'{month // 12:04d}-{month % 12 + 1:02d}' for month in cohort_months], name='Cohort')
+    table = pd.DataFrame(active, index=labels, columns=list(range(n_offsets)))
+    table.insert(0, 'Buyers', n_buyers)
+    table.insert(1, 'Repeat Buyers', n_repeat)
+    table.insert(2, 'Repeat Rate', n_repeat / n_buyers)
+    return table
+
+def retention_matrix(table):
+    """
+    Returns the share of each cohort's buyers active every month after their
+    first purchase, NaN for the months after the last sale.
+    """
+    offsets = [col_name for col_name in table.columns if isinstance(col_name, (int, np.integer))]
+    rates = table[offsets].div(table['Buyers'], axis=0)
+
+    # A cohort is only observed until the month of the latest cohort
+    months = np.array([int(label[:4]) * 12 + int(label[5:]) - 1 for label in table.index], dtype=np.int64)
+    observed = months.max() - months if len(months) else months
+    return rates.where(np.arange(len(offsets)) <= observed[:, None])
+
+def repeat_purchase_rate(table):
+    """
+    Returns the share of all the buyers of a cohort table who ordered more
+    than once.
+    """
+    buyers = table['Buyers'].sum()
+    return table['Repeat Buyers'].sum() / buyers if buyers else float('nan')
@@ -0,0 +1,153 @@
+# Import libraries
+
+import numpy as np
+import pandas as pd
+
+# Define functions
+
+def _hash64(values):
+    # SplitMix64 finalizer: spreads int64 values uniformly over 64 bits
+    with np.errstate(over='ignore'):
+        x = values.astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+def _bit_length(values):
+    # Number of significant bits of each uint64 value, by binary search
+    values = values.copy()
+    lengths = np.zeros(len(values), dtype=np.uint8)
+    for shift in (32, 16, 8, 4, 2, 1):
+        high = values >= (np.uint64(1) << np.uint64(shift))
+        lengths[high] += shift
+        values[high] >>= np.uint64(shift)
+    lengths[values > 0] += 1
+    return lengths
+
+def _group_by_key(keys, ids):
+    # Split ids into one array per distinct key, dropping missing keys
+    codes, uniques = pd.factorize(keys)
+    valid = codes >= 0
+    codes, ids = codes[valid], ids[valid]
+    order = np.argsort(codes, kind='stable')
+    codes, ids = codes[order], ids[order]
+    if len(codes) == 0:
+        return []
+    boundaries = np.flatnonzero(np.diff(codes)) + 1
+    labels = np.asarray(uniques, dtype=object)[codes[np.r_[0, boundaries]]]
+    return zip(labels, np.split(ids, boundaries))
+
+def _copy_ids(ids):
+    # Copy a sorted id array or a sketch, so merged counters do not share state
+    if isinstance(ids, HyperLogLog):
+        sketch = HyperLogLog(ids.precision)
+        sketch.registers[:] = ids.registers
+        return sketch
+    return ids.copy()
+
+# Define classes
+
+class HyperLogLog:
+    """
+    An approximate distinct counter of int64 values using 2**precision
+    one-byte registers. The standard error is about 1.04 / sqrt(2**precision),
+    0.8% for the default precision of 14 (16 KiB per counter).
+    """
+
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add(self, values):
+        hashes = _hash64(np.asarray(values, dtype=np.int64))
+
+        # The first bits choose the register, the rank of the remaining bits
+        # is the position of their first set bit
+        p = np.uint64(self.precision)
+        index = (hashes >> (np.uint64(64) - p)).astype(np.intp)
+        remaining = hashes & ((np.uint64(1) << (np.uint64(64) - p)) - np.uint64(1))
+        rank = (64 - self.precision + 1 - _bit_length(remaining).astype(np.int64)).astype(np.uint8)
+
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError('Cannot merge HyperLogLog counters of different precision')
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+
+        # Use linear counting for small cardinalities
+        zeros = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * m and zeros > 0:
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+class DistinctCounter:
+    """
+    Counts distinct int64 ids (such as Order IDs) per key (such as Ship
+    State). Counters built from separate parts of the data, in separate
+    chunks or processes, can be merged into the counts of all the data.
+
+    Parameters:
+        approximate (bool): Whether to keep a HyperLogLog sketch per key
+        instead of the exact set of ids. Defaults to False.
+        precision (int): The precision of the HyperLogLog sketches.
+    """
+
+    def __init__(self, approximate=False, precision=14):
+        self.approximate = approximate
+        self.precision = precision
+        # Each key maps to a sorted array of unique ids, or to a sketch
+        self._ids = {}
+
+    def add(self, keys, ids):
+        """
+        Adds the ids of the given keys; keys and ids are aligned arrays.
+        Missing keys are ignored.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        for key, key_ids in _group_by_key(np.asarray(keys, dtype=object), ids):
+            if self.approximate:
+                self._ids.setdefault(key, HyperLogLog(self.precision)).add(key_ids)
+            elif key in self._ids:
+                self._ids[key] = np.union1d(self._ids[key], key_ids)
+            else:
+                self._ids[key] = np.unique(key_ids)
+        return self
+
+    def merge(self, other):
+        """
+        Adds the ids counted by another counter of the same mode.
+        """
+        if other.approximate != self.approximate:
+            raise ValueError('Cannot merge exact and approximate distinct counters')
+        for key, other_ids in other._ids.items():
+            if key not in self._ids:
+                self._ids[key] = _copy_ids(other_ids)
+            elif self.approximate:
+                self._ids[key].merge(other_ids)
+            else:
+                self._ids[key] = np.union1d(self._ids[key], other_ids)
+        return self
+
+    def counts(self):
+        """
+        Returns the number of distinct ids of each key as a Series.
+        """
+        return pd.Series(
+            {key: ids.count() if self.approximate else len(ids) for key, ids in self._ids.items()},
+            dtype='int64')
+
+def merge_counters(counters):
+    """
+    Returns a new counter holding the union of the given counters.
+    """
+    counters = list(counters)
+    merged = DistinctCounter(counters[0].approximate, counters[0].precision)
+    for counter in counters:
+        merged.merge(counter)
+    return merged
@@ -0,0 +1,148 @@
+# Import libraries
+
+import pandas as pd
+
+import instrumentation
+
+# Bump whenever the dtypes below change, so that cached frames parsed with an
+# older schema are not reused
+SCHEMA_VERSION = 1
+
+# Format of the date columns in the Etsy "Sold Orders" export, e.g. 12/31/22
+DATE_FORMAT = '%m/%d/%y'
+
+# Columns of the Etsy "Sold Orders" CSV export, in file order, with the dtype
+# each one is read as. Date columns are read as strings and parsed afterwards.
+COLUMN_DTYPES = {
+    'Sale Date': str,
+    'Order ID': 'int64',
+    'Buyer User ID': str,
+    'Full Name': str,
+    'First Name': str,
+    'Last Name': str,
+    'Number of Items': 'int64',
+    'Payment Method': 'category',
+    'Date Shipped': str,
+    'Street 1': str,
+    'Street 2': str,
+    'Ship City': str,
+    'Ship State': 'category',
+    'Ship Zipcode': str,
+    'Ship Country': 'category',
+    'Currency': 'category',
+    'Order Value': 'float64',
+    'Coupon Code': str,
+    'Coupon Details': str,
+    'Discount Amount': 'float64',
+    'Shipping Discount': 'float64',
+    'Shipping': 'float64',
+    'Sales Tax': 'float64',
+    'Order Total': 'float64',
+    'Status': 'category',
+    'Card Processing Fees': 'float64',
+    'Order Net': 'float64',
+    'Adjusted Order Total': 'float64',
+    'Adjusted Card Processing Fees': 'float64',
+    'Adjusted Net Order Amount': 'float64',
+    'Buyer': str,
+    'Order Type': 'category',
+    'Payment Type': 'category',
+    'InPerson Discount': 'float64',
+    'InPerson Location': str,
+    'SKU': str,
+}
+
+# Columns that are parsed into datetime64 values using DATE_FORMAT
+DATE_COLUMNS = ['Sale Date', 'Date Shipped']
+
+# Columns identifying buyers, which are masked in uploaded exports
+NAME_COLUMNS = ['Buyer User ID', 'Full Name', 'First Name', 'Last Name', 'Buyer']
+
+# Column of the buyers' Etsy user ids, which is pseudonymized rather than
+# masked, so that the orders of a buyer can still be joined
+BUYER_ID_COLUMN = 'Buyer User ID'
+
+# Columns holding amounts of money, in the currency of the shop
+MONEY_COLUMNS = [
+    'Order Value', 'Discount Amount', 'Shipping Discount', 'Shipping', 'Sales Tax', 'Order Total',
+    'Card Processing Fees', 'Order Net', 'Adjusted Order Total', 'Adjusted Card Processing Fees',
+    'Adjusted Net Order Amount',
+]
+
+# Columns used by the dashboards of the main page
+APP_COLUMNS = ['Sale Date', 'Order ID'] + NAME_COLUMNS[:4] + [
+    'Number of Items', 'Date Shipped', 'Ship State', 'Ship Country', 'Buyer', 'SKU'
+] + MONEY_COLUMNS
+
+# Define functions
+
+def has_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def _read_header(filepath_or_buffer):
+    # Read only the header row, rewinding buffers so they can be read again
+    header = pd.read_csv(filepath_or_buffer, nrows=0).columns
+    if hasattr(filepath_or_buffer, 'seek'):
+        filepath_or_buffer.seek(0)
+    return list(header)
+
+def _read_options(filepath_or_buffer, columns):
+    # Return the usecols and dtype arguments of pd.read_csv for the columns,
+    # tolerating exports that lack some of them
+    if columns is None:
+        return None, COLUMN_DTYPES
+    wanted = set(columns)
+    usecols = [col_name for col_name in _read_header(filepath_or_buffer) if col_name in wanted]
+    dtypes = {col_name: COLUMN_DTYPES[col_name] for col_name in usecols if col_name in COLUMN_DTYPES}
+    return usecols, dtypes
+
+def parse_date_columns(df):
+    """
+    Parses the date columns of the orders in place with DATE_FORMAT.
+    Unparseable dates become NaT.
+    """
+    for col_name in DATE_COLUMNS:
+        if col_name in df.columns:
+            df[col_name] = pd.to_datetime(df[col_name], format=DATE_FORMAT, errors='coerce')
+
+@instrumentation.timed()
+def read_orders_csv(filepath_or_buffer, columns=None, engine='c'):
+    """
+    Reads an Etsy "Sold Orders" CSV export with the dtypes of COLUMN_DTYPES,
+    keeping only the requested columns and parsing the date columns.
+
+    Parameters:
+        filepath_or_buffer (str or file-like): The CSV file to read. Buffers
+        must be seekable when columns is given.
+        columns (list): The columns to read. Columns missing from the file
+        are skipped. Defaults to None, which reads every column.
+        engine (str): The pandas parser engine, 'c' or 'pyarrow'. 'pyarrow'
+        falls back to 'c' when pyarrow is not installed. Defaults to 'c'.
+
+    Returns:
+        pandas.DataFrame: The orders, with the columns in file order.
+    """
+    if engine == 'pyarrow' and not has_pyarrow():
+        engine = 'c'
+
+    usecols, dtypes = _read_options(filepath_or_buffer, columns)
+    df = pd.read_csv(filepath_or_buffer, usecols=usecols, dtype=dtypes, engine=engine)
+    parse_date_columns(df)
+
+    return df
+
+def iter_orders_csv(filepath_or_buffer, chunksize=100_000, columns=None):
+    """
+    Reads an Etsy "Sold Orders" CSV export like read_orders_csv, but yields
+    DataFrames of at most chunksize rows, so that the whole export never has
+    to be held in memory at once.
+    """
+    usecols, dtypes = _read_options(filepath_or_buffer, columns)
+    with pd.read_csv(filepath_or_buffer, usecols=usecols, dtype=dtypes, chunksize=chunksize) as reader:
+        for chunk in reader:
+            parse_date_columns(chunk)
+            yield chunk
@@ -0,0 +1,133 @@
+# Import libraries
+
+import numpy as np
+import pandas as pd
+
+import instrumentation
+
+# Latencies of this many days or more are counted in the last bin of the
+# histograms
+MAX_LATENCY_DAYS = 30
+
+# Percentiles of the latency reported by latency_percentiles
+LATENCY_PERCENTILES = [50, 90, 99]
+
+# Day offset of a missing date
+MISSING_DAY = np.iinfo(np.int32).min
+
+# Days between 1970-01-01, a Thursday, and the Monday starting its week
+_EPOCH_WEEKDAY = 3
+
+# Define functions
+
+def day_offsets(dates):
+    """
+    Returns datetime64 values as int32 numbers of days since 1970-01-01, with
+    MISSING_DAY for NaT.
+    """
+    dates = np.asarray(dates)
+    days = dates.astype('datetime64[D]').astype(np.int64)
+    days[np.isnat(dates)] = MISSING_DAY
+    return days.astype(np.int32)
+
+def order_latencies(df):
+    """
+    Returns the sale day and the fulfillment latency of each order as int32
+    arrays: the day offset of 'Sale Date' and the number of days until 'Date
+    Shipped', -1 for orders not shipped yet. Both columns are parsed once, as
+    day offsets.
+    """
+    sale_days = day_offsets(df['Sale Date'])
+    shipped_days = day_offsets(df['Date Shipped'])
+    shipped = shipped_days != MISSING_DAY
+
+    # Orders marked as shipped before their sale date count as shipped the same day
+    latencies = np.where(shipped, np.maximum(shipped_days - sale_days, 0), -1).astype(np.int32)
+    return sale_days, latencies
+
+@instrumentation.timed()
+def build_latency_cube(df, max_days=MAX_LATENCY_DAYS):
+    """
+    Builds the histograms of the fulfillment latency of the orders by week of
+    sale and Ship State. Cubes of separate chunks of the orders can be merged
+    with merge_latency_cubes, and any range of weeks summed by
+    latency_histogram without going back to the orders.
+
+    Parameters:
+        df (pandas.DataFrame): A DataFrame containing order data, including
+        the columns 'Sale Date', 'Date Shipped' and 'Ship State', with the
+        dates parsed.
+        max_days (int): Latencies of max_days or more are counted in the
+        max_days bin. Defaults to MAX_LATENCY_DAYS.
+
+    Returns:
+        pandas.DataFrame: One row per (Week, Ship State) with orders, indexed
+        by the Monday starting the week and the state, with the int32 number
+        of orders shipped after 0 to max_days days in columns 0 to max_days
+        and of the orders not shipped yet in a 'Not Shipped' column.
+    """
+    sale_days, latencies = order_latencies(df)
+    valid = sale_days != MISSING_DAY
+    state_codes, states = pd.factorize(df['Ship State'])
+    sale_days, latencies, state_codes = sale_days[valid], latencies[valid], state_codes[valid]
+
+    # Number the cells of the orders, then count each (cell, bin) pair at once;
+    # the bin of unshipped orders is the last one
+    weeks = (sale_days + _EPOCH_WEEKDAY) // 7
+    cells, cell_codes = np.unique(weeks.astype(np.int64) * (len(states) + 1) + state_codes + 1, return_inverse=True)
+    n_bins = max_days + 2
+    bins = np.where(latencies < 0, n_bins - 1, np.minimum(latencies, max_days))
+    counts = np.bincount(cell_codes.ravel() * n_bins + bins, minlength=len(cells) * n_bins)
+
+    # Label each cell with its week and state, NaN for a missing state
+    week_starts = (cells // (len(states) + 1)) * 7 - _EPOCH_WEEKDAY
+    state_labels = np.append(np.nan, np.asarray(states, dtype=object))[cells % (len(states) + 1)]
+    index = pd.MultiIndex.from_arrays(
+        [pd.to_datetime(week_starts, unit='D'), state_labels], names=['Week', 'Ship State'])
+    return pd.DataFrame(counts.reshape(len(cells), n_bins).astype(np.int32), index=index,
+                        columns=list(range(max_days + 1)) + ['Not Shipped'])
+
+def merge_latency_cubes(cubes):
+    """
+    Adds latency cubes built from separate parts of the orders (such as the
+    chunks of a large export) into the latency cube of all the orders.
+    """
+    cube = pd.concat(cubes).groupby(level=['Week', 'Ship State'], sort=True, dropna=False).sum()
+    return cube.astype(np.int32)
+
+def latency_histogram(cube, start_date=None, end_date=None, by='Week'):
+    """
+    Returns the latency histogram of the orders sold in the weeks overlapping
+    start_date to end_date, by 'Week' or by 'Ship State', or as a single row
+    when by is None.
+    """
+    weeks = cube.index.get_level_values('Week')
+    in_range = np.ones(len(cube), dtype=bool)
+    if start_date is not None:
+        in_range &= weeks > pd.Timestamp(start_date) - pd.Timedelta(days=7)
+    if end_date is not None:
+        in_range &= weeks <= pd.Timestamp(end_date)
+    if by is None:
+        return cube[in_range].sum().to_frame('All').T
+    return cube[in_range].groupby(level=by, sort=True).sum()
+
+def latency_percentiles(histogram, percentiles=LATENCY_PERCENTILES):
+    """
+    Returns the given percentiles of the latency in days of each row of a
+    latency histogram, read off the cumulative counts, with the number of
+    orders shipped and not shipped yet. Percentiles of rows without shipped
+    orders are NaN; the last bin stands for MAX_LATENCY_DAYS or more days.
+    """
+    counts = histogram.drop(columns='Not Shipped').to_numpy()
+    cumulative = counts.cumsum(axis=1)
+    shipped = cumulative[:, -1] if counts.size else np.zeros(len(counts), dtype=np.int64)
+
+    result = pd.DataFrame(index=histogram.index)
+    for q in percentiles:
+        # The latency of the order ranked ceil(q% of the shipped orders)
+        rank = np.maximum(np.ceil(shipped * q / 100), 1)
+        days = (cumulative < rank[:, None]).sum(axis=1).astype(np.float64)
+        result[f'p{q}'] = np.where(shipped > 0, days, np.nan)
+    result['Orders Shipped'] = shipped
+    result['Not Shipped'] = histogram['Not Shipped'].to_numpy()
+    return result
@@ -0,0 +1,415 @@
+# Import libraries
+
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import etsy_schema
+import instrumentation
+import my_functions
+
+# Path of the sample dataset shipped with the app
+SAMPLE_DATA_PATH = 'EtsySoldOrders2022_masked.csv'
+
+# Directory of the on-disk cache of parsed uploads
+DISK_CACHE_DIR = os.path.join('.cache', 'orders')
+
+# Path of the secret key of the buyer pseudonyms, created on first use
+PSEUDONYM_KEY_PATH = os.path.join('.cache', 'pseudonym_key')
+
+# Define classes
+
+class FrameCache:
+    """
+    A thread-safe LRU cache of parsed DataFrames, keyed by a content hash
+    and bounded both by the number of entries and by their total memory size.
+
+    Parameters:
+        max_entries (int): The maximum number of DataFrames to keep.
+        max_bytes (int): The maximum total memory usage of the cached
+        DataFrames, as reported by DataFrame.memory_usage(deep=True).
+    """
+
+    def __init__(self, max_entries=8, max_bytes=512 * 1024 ** 2):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    def get(self, key):
+        """
+        Returns a read-only view of the cached DataFrame for key, or None
+        if the key is not cached. The entry becomes the most recently used.
+        """
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            df, _ = self._entries[key]
+        return _read_only_view(df)
+
+    def put(self, key, df):
+        """
+        Stores df under key, evicting the least recently used entries until
+        the cache fits its bounds again. A DataFrame larger than max_bytes is
+        not cached at all. df may also be a Series. Returns a read-only view
+        of df.
+        """
+        usage = df.memory_usage(index=True, deep=True)
+        size = int(usage.sum() if isinstance(df, pd.DataFrame) else usage)
+        _make_read_only(df)
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)[1]
+            if size <= self.max_bytes:
+                self._entries[key] = (df, size)
+                self._total_bytes += size
+            # Evict the least recently used entries until both bounds hold
+            while self._entries and (len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_size
+        return _read_only_view(df)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+class DiskCache:
+    """
+    A cache of parsed DataFrames stored as uncompressed Feather files, which
+    are memory-mapped when read back. The files are named after the hash of
+    their key, and the least recently used ones are deleted once the
+    directory grows past max_bytes. Requires pyarrow; without it the cache
+    is disabled and get always returns None.
+
+    Parameters:
+        directory (str): The directory holding the cached files.
+        max_bytes (int): The maximum total size of the cached files.
+    """
+
+    def __init__(self, directory=DISK_CACHE_DIR, max_bytes=2 * 1024 ** 3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return etsy_schema.has_pyarrow()
+
+    def _path(self, key):
+        return os.path.join(self.directory, hash_bytes(key.encode())[:32] + '.feather')
+
+    def get(self, key):
+        """
+        Returns the DataFrame cached under key, or None if it is not cached.
+        """
+        path = self._path(key)
+        if not self.enabled or not os.path.exists(path):
+            return None
+
+        from pyarrow import feather
+
+        try:
+            df = feather.read_table(path, memory_map=True).to_pandas()
+        except (OSError, ValueError):
+            # Ignore files that were truncated or written by another version
+            return None
+
+        # Mark the file as recently used, unless another process evicted it
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return df
+
+    def put(self, key, df):
+        """
+        Stores df under key and evicts the least recently used files until
+        the directory fits max_bytes again. Failures to write are ignored.
+        """
+        if not self.enabled:
+            return
+
+        from pyarrow import feather
+
+        tmp_path = None
+        try:
+            # Write to a temporary file first, so readers never see a partial file
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            os.close(fd)
+            feather.write_feather(df.reset_index(drop=True), tmp_path, compression='uncompressed')
+            os.replace(tmp_path, self._path(key))
+        except (OSError, ValueError):
+            # Remove the partial file, which _evict never counts; pyarrow raises
+            # ArrowInvalid, a ValueError, for columns it cannot store
+            if tmp_path is not None:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+            return
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.directory):
+                if name.endswith('.feather'):
+                    # Skip the files another process evicted since the listing
+                    try:
+                        stat = os.stat(os.path.join(self.directory, name))
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, name))
+
+            # Delete the least recently used files until the rest fit
+            total_bytes = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total_bytes <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+                total_bytes -= size
+
+# Process-wide cache shared by every session and rerun of the app
+frame_cache = FrameCache()
+
+# Cache shared by every process of the app and kept across restarts
+disk_cache = DiskCache()
+
+# Define functions
+
+def _make_read_only(df):
+    # Mark the arrays holding the data of a frame or Series as not writeable,
+    # including those inside extension arrays (the codes of categoricals, the
+    # values and mask of nullable integers), so that in-place writes such as
+    # df.loc[i, col] = ... raise instead of changing the cached data that
+    # every session shares
+    for values in df._mgr.arrays:
+        for array in (values, getattr(values, '_ndarray', None), getattr(values, '_data', None),
+                      getattr(values, '_mask', None)):
+            if isinstance(array, np.ndarray):
+                array.flags.writeable = False
+
+def _read_only_view(df):
+    # Return a shallow copy so that adding or replacing columns on a rerun
+    # never changes the cached frame, whose arrays _make_read_only protected
+    # from in-place writes
+    return df.copy(deep=False)
+
+def hash_bytes(data):
+    """
+    Returns the SHA-256 hex digest of the given bytes, used as the content
+    key of a parsed DataFrame.
+    """
+    return hashlib.sha256(data).hexdigest()
+
+def get_pseudonym_key(path=PSEUDONYM_KEY_PATH):
+    """
+    Returns the secret key of the buyer pseudonyms: the SHA-256 of the
+    ETSY_APP_PSEUDONYM_KEY environment variable when set, or else the random
+    key stored at path, written the first time it is needed. Pseudonyms stay
+    joinable across uploads and restarts for as long as the key is kept.
+    """
+    secret = os.environ.get('ETSY_APP_PSEUDONYM_KEY')
+    if secret:
+        return hashlib.sha256(secret.encode()).digest()
+
+    # Create the key exclusively, so that concurrent processes agree on it
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        pass
+    else:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(os.urandom(32))
+
+    # Wait for a key being written by another process
+    for _ in range(100):
+        with open(path, 'rb') as f:
+            key = f.read()
+        if len(key) == 32:
+            return key
+        time.sleep(0.01)
+    raise ValueError(f'Invalid pseudonym key in {path}')
+
+def prepare_orders(df, mask=True):
+    """
+    Masks the buyer name columns of freshly read orders and replaces the
+    buyer user ids with keyed pseudonyms when mask is True, and adds the date
+    features of add_date_columns.
+    """
+    # Mask the data
+    if mask:
+        col_names = [col_name for col_name in etsy_schema.NAME_COLUMNS
+                     if col_name in df.columns and col_name != etsy_schema.BUYER_ID_COLUMN]
+        df = my_functions.mask_names_inplace(df, col_names)
+        if etsy_schema.BUYER_ID_COLUMN in df.columns:
+            df[etsy_schema.BUYER_ID_COLUMN] = my_functions.pseudonymize_values(
+                df[etsy_schema.BUYER_ID_COLUMN], get_pseudonym_key())
+
+    # Derive the date features once, so that the pages never recompute them
+    if 'Sale Date' in df.columns:
+        my_functions.add_date_columns(df, 'Sale Date', date_format=etsy_schema.DATE_FORMAT)
+
+    return df
+
+@instrumentation.timed()
+def parse_orders(data, mask=True, columns=etsy_schema.APP_COLUMNS, engine='c'):
+    """
+    Parses the bytes of an Etsy "Sold Orders" CSV export into a typed
+    DataFrame holding only the given columns, prepared by prepare_orders.
+    """
+    df = etsy_schema.read_orders_csv(io.BytesIO(data), columns=columns, engine=engine)
+    return prepare_orders(df, mask=mask)
+
+def iter_order_chunks(data, chunksize=100_000, mask=True, columns=etsy_schema.APP_COLUMNS):
+    """
+    Parses the bytes of an Etsy "Sold Orders" CSV export like parse_orders,
+    but yields prepared DataFrames of at most chunksize rows.
+    """
+    for chunk in etsy_schema.iter_orders_csv(io.BytesIO(data), chunksize=chunksize, columns=columns):
+        yield prepare_orders(chunk, mask=mask)
+
+def make_cache_key(data, mask=True, columns=etsy_schema.APP_COLUMNS):
+    """
+    Returns the cache key of the DataFrame parsed from the given bytes: the
+    content hash, the schema version and the way the frame was prepared,
+    including the pseudonym key the buyer ids were hashed with.
+    """
+    columns_key = 'all' if columns is None else hash_bytes('\x1f'.join(columns).encode())[:16]
+    mask_key = hash_bytes(get_pseudonym_key())[:16] if mask else 'none'
+    return f'{hash_bytes(data)}:v{etsy_schema.SCHEMA_VERSION}:mask={mask_key}:columns={columns_key}'
+
+def load_orders(data, mask=True, columns=etsy_schema.APP_COLUMNS, engine='c', cache=frame_cache, disk_cache=disk_cache):
+    """
+    Returns the parsed (and optionally masked) orders for the given CSV
+    bytes, parsing them only if the same content has not been loaded before.
+
+    Parameters:
+        data (bytes): The contents of an Etsy "Sold Orders" CSV export.
+        mask (bool): Whether to mask the buyer name columns. Defaults to True.
+        columns (list): The columns to read, or None for every column.
+        Defaults to the columns used by the main page.
+        engine (str): The parser engine, 'c' or 'pyarrow'. Defaults to 'c'.
+        cache (FrameCache): The cache to look up and store the DataFrame in.
+        disk_cache (DiskCache): The on-disk cache consulted when the frame is
+        not in cache, or None to skip it.
+
+    Returns:
+        pandas.DataFrame: A read-only view of the parsed orders. The cache
+        key is stored in df.attrs['fingerprint'].
+    """
+    key = make_cache_key(data, mask=mask, columns=columns)
+
+    df = cache.get(key)
+    if df is None:
+        # Reuse the frame parsed by an earlier session or process if possible
+        df = disk_cache.get(key) if disk_cache is not None else None
+        if df is None:
+            df = parse_orders(data, mask=mask, columns=columns, engine=engine)
+            if disk_cache is not None:
+                disk_cache.put(key, df)
+        df.attrs['fingerprint'] = key
+        df = cache.put(key, df)
+
+    return df
+
+def combine_keys(keys):
+    """
+    Returns a key identifying the combination of several cached frames, in
+    order.
+    """
+    return hash_bytes('\n'.join(keys).encode())
+
+@instrumentation.timed()
+def concat_orders(frames):
+    """
+    Concatenates the orders of several exports into one typed DataFrame,
+    keeping categorical columns categorical, and drops the orders that
+    appear in more than one export (by Order ID, keeping the first).
+    """
+    frames = [frame.copy(deep=False) for frame in frames]
+
+    # Give each categorical column the union of the categories of all frames,
+    # so that pd.concat does not fall back to object columns
+    for col_name in frames[0].columns:
+        if all(col_name in frame.columns and isinstance(frame[col_name].dtype, pd.CategoricalDtype) for frame in frames):
+            categories = frames[0][col_name].cat.categories
+            for frame in frames[1:]:
+                categories = categories.union(frame[col_name].cat.categories)
+            for frame in frames:
+                frame[col_name] = frame[col_name].cat.set_categories(categories)
+
+    df = pd.concat(frames, ignore_index=True)
+    return df.drop_duplicates('Order ID', keep='first', ignore_index=True)
+
+def load_orders_many(datas, mask=True, columns=etsy_schema.APP_COLUMNS, max_workers=None, cache=frame_cache):
+    """
+    Returns the combined orders of several CSV exports (such as one per year),
+    parsing and masking the exports concurrently with load_orders and
+    combining them with concat_orders.
+
+    Parameters:
+        datas (list): The contents of each CSV export, as bytes.
+        mask (bool): Whether to mask the buyer name columns. Defaults to True.
+        columns (list): The columns to read, or None for every column.
+        max_workers (int): The number of threads parsing the exports.
+        Defaults to one per export, up to the number of CPUs.
+        cache (FrameCache): The cache to look up and store the DataFrames in.
+
+    Returns:
+        pandas.DataFrame: A read-only view of the combined orders.
+    """
+    if len(datas) == 1:
+        return load_orders(datas[0], mask=mask, columns=columns, cache=cache)
+
+    key = combine_keys([make_cache_key(data, mask=mask, columns=columns) for data in datas]) + ':combined'
+    df = cache.get(key)
+    if df is None:
+        # pandas releases the GIL while parsing, so the exports are parsed in parallel threads
+        max_workers = max_workers or min(len(datas), os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            frames = list(executor.map(lambda data: load_orders(data, mask=mask, columns=columns, cache=cache), datas))
+
+        df = concat_orders(frames)
+        df.attrs['fingerprint'] = key
+        df = cache.put(key, df)
+
+    return df
+
+def load_uploaded_files(uploaded_files, cache=frame_cache):
+    """
+    Returns the combined masked orders of the files uploaded through
+    st.file_uploader with accept_multiple_files=True.
+    """
+    return load_orders_many([uploaded_file.getvalue() for uploaded_file in uploaded_files], mask=True, cache=cache)
+
+def load_sample_data(path=SAMPLE_DATA_PATH, cache=frame_cache):
+    """
+    Returns the orders of the sample dataset, which is already masked.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    return load_orders(data, mask=False, cache=cache)
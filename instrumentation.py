@@ -0,0 +1,201 @@
+# Import libraries
+
+import contextlib
+import functools
+import importlib
+import json
+import sys
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+
+# Records of the stages that ran in each thread's current recording
+_local = threading.local()
+
+# Wall times in seconds of the imports made by this process, by module name
+import_timings = {}
+
+# Held by the thread running a traced top-level stage. tracemalloc's peak is
+# process-wide, so traced stages of concurrent recordings (such as the reruns
+# of two sessions) run one at a time rather than resetting each other's peak
+_tracing_lock = threading.RLock()
+
+# Define functions
+
+def _current():
+    # Return the records and the stack of open stages of this thread's
+    # recording, or None when nothing is being recorded
+    return getattr(_local, 'recording', None)
+
+def start_recording():
+    """
+    Starts recording the stages run by this thread, such as one rerun of the
+    app, discarding any earlier recording, and returns the list the records
+    are appended to. Each record is a dict with the stage name, its wall time
+    in seconds, the number of rows it processed, the peak memory it allocated
+    in bytes while tracemalloc is tracing, and its nesting depth.
+    """
+    _local.recording = ([], [])
+    return _local.recording[0]
+
+def stop_recording():
+    """
+    Stops recording the stages run by this thread.
+    """
+    _local.recording = None
+
+@contextlib.contextmanager
+def recording():
+    """
+    Records the stages run by this thread inside the with block and yields
+    the list of records, like start_recording.
+    """
+    previous = _current()
+    records = start_recording()
+    try:
+        yield records
+    finally:
+        _local.recording = previous
+
+@contextlib.contextmanager
+def stage(name, rows=None):
+    """
+    Records the wall time and peak memory of the with block as a stage named
+    name, if a recording is active in this thread. Yields a dict whose 'rows'
+    the block may set when the number of rows is only known at the end.
+
+    While tracemalloc is tracing, the top-level stages of all the recording
+    threads run one at a time, so that their peaks stay apart. The peak still
+    includes whatever other threads allocate outside of stages meanwhile.
+    """
+    details = {'rows': rows}
+    current = _current()
+    if current is None:
+        yield details
+        return
+
+    records, stack = current
+    tracing = tracemalloc.is_tracing()
+    frame = {'start_memory': 0, 'child_peak': 0, 'locked': False}
+    if tracing:
+        if not stack:
+            _tracing_lock.acquire()
+            frame['locked'] = True
+        frame['start_memory'] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+    stack.append(frame)
+
+    start = time.perf_counter()
+    try:
+        yield details
+    finally:
+        wall_time = time.perf_counter() - start
+        stack.pop()
+
+        peak_memory = None
+        if tracing:
+            # reset_peak in nested stages hides their peaks from this one, so
+            # they report them through child_peak
+            peak = max(tracemalloc.get_traced_memory()[1], frame['child_peak'])
+            peak_memory = max(0, peak - frame['start_memory'])
+            if stack:
+                stack[-1]['child_peak'] = max(stack[-1]['child_peak'], peak)
+        if frame['locked']:
+            _tracing_lock.release()
+
+        records.append({
+            'stage': name,
+            'wall_time_s': wall_time,
+            'rows': details['rows'],
+            'peak_memory_delta_bytes': peak_memory,
+            'depth': len(stack),
+        })
+
+def _count_rows(args, kwargs):
+    # Count the rows of the first DataFrame or Series argument
+    for value in list(args) + list(kwargs.values()):
+        if isinstance(value, (pd.DataFrame, pd.Series)):
+            return len(value)
+    return None
+
+def timed(name=None):
+    """
+    Decorates a function so that each call is recorded as a stage, named
+    after the function unless name is given. The rows are those of the first
+    DataFrame or Series argument, or else of the DataFrame returned.
+    """
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current() is None:
+                return func(*args, **kwargs)
+            with stage(stage_name, rows=_count_rows(args, kwargs)) as details:
+                result = func(*args, **kwargs)
+                if details['rows'] is None and isinstance(result, (pd.DataFrame, pd.Series)):
+                    details['rows'] = len(result)
+                return result
+
+        return wrapper
+    return decorator
+
+def import_module(name):
+    """
+    Imports a module the first time it is needed rather than when the app
+    starts, recording the wall time of the import in import_timings and as a
+    stage of the current recording. Returns the module.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    with stage('import ' + name):
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        import_timings[name] = time.perf_counter() - start
+    return module
+
+def records_to_frame(records):
+    """
+    Returns the records as a DataFrame, in the order the stages finished.
+    """
+    return pd.DataFrame(records, columns=['stage', 'wall_time_s', 'rows', 'peak_memory_delta_bytes', 'depth'])
+
+def records_to_jsonl(records, **extra):
+    """
+    Returns the records as JSON lines, adding the extra fields (such as a run
+    id or timestamp) to each line.
+    """
+    return ''.join(json.dumps({**extra, **record}) + '\n' for record in records)
+
+def dump_jsonl(records, path, **extra):
+    """
+    Appends the records to a JSON lines file for offline analysis.
+    """
+    with open(path, 'a') as f:
+        f.write(records_to_jsonl(records, **extra))
+
+def show_timings_panel(records):
+    """
+    Shows the recorded stages in a collapsible panel of the sidebar, with a
+    button to download them as JSON lines. Peak memory is only recorded when
+    tracemalloc is tracing, and is approximate while other sessions run.
+    """
+    import streamlit as st
+
+    with st.sidebar.expander("Pipeline timings"):
+        if import_timings:
+            st.write(f"Imports at startup and first use: {sum(import_timings.values()) * 1000:.1f} ms")
+            st.dataframe(pd.DataFrame({'module': list(import_timings), 'wall_time_s': list(import_timings.values())}))
+        if not records:
+            st.write("Nothing was recomputed on this run.")
+            return
+        timings = records_to_frame(records)
+        st.write(f"Total: {timings.loc[timings['depth'] == 0, 'wall_time_s'].sum() * 1000:.1f} ms")
+        if tracemalloc.is_tracing():
+            st.caption("Peak memory includes what other sessions allocate outside of their timed stages meanwhile.")
+        st.dataframe(timings)
+        st.download_button("Download as JSON lines", records_to_jsonl(records, timestamp=time.time()),
+                           file_name='timings.jsonl', mime='application/jsonl')
@@ -2,51 +2,126 @@
 
 import pandas as pd
 import numpy as np
+import os
 import re
+import hashlib
 import copy
 import calendar
-import matplotlib.pyplot as plt
-import plotly.express as px
-import streamlit as st
+import instrumentation
 
 # Define functions
 
+def new_figure(**kwargs):
+    """
+    Returns a matplotlib Figure, importing matplotlib when the first chart is
+    drawn rather than when the app starts. The figure is not managed by
+    pyplot, so it needs no interactive backend and is freed with its last
+    reference.
+    """
+    return instrumentation.import_module('matplotlib.figure').Figure(**kwargs)
+
+# Regular expression matching the characters of a word after its first letter.
+# Equivalent to masking every match of r'\B\w', but replaces each word with
+# a single substitution instead of one per character
+NAME_MASK_REGEX = re.compile(r'(?<=\w)\w+')
+
+def _mask_uniques(uniques):
+    # Mask every distinct value and append NaN for the missing values, so that
+    # the factorize code -1 picks the last element
+    return np.array(
+        [NAME_MASK_REGEX.sub(lambda match: '*' * len(match.group()), name) if isinstance(name, str) else np.nan
+         for name in uniques] + [np.nan],
+        dtype=object)
+
+@instrumentation.timed()
 def mask_names_inplace(df, col_names):
     
-    # create a deep copy of the original list
-    df_copy = copy.deepcopy(df)
-    # Define a regular expression to replace all characters in a word except the first letter
-    regex = re.compile(r'\B\w')
-
-    # Loop through the column names and replace each column with masked values using regex
-    for col_name in col_names:
-        # Use the .loc accessor to apply the lambda function to each element of the column in place
-        df_copy.loc[:, col_name] = df_copy[col_name].apply(lambda name: 
-            # If the element is a string, apply the regular expression to mask the name
-            regex.sub('*', str(name)) if isinstance(name, str) else 
-            # Otherwise, return NaN to handle missing values
-            np.nan) 
+    # Create a shallow copy so that only the masked columns are copied
+    df_copy = df.copy(deep=False)
+    if len(col_names) == 0:
+        return df_copy
+
+    # Stack the columns so that a name appearing in several of them (such as
+    # 'Full Name' and 'Buyer') is masked only once, then factorize the values
+    values = np.concatenate([df_copy[col_name].to_numpy(dtype=object) for col_name in col_names])
+    codes, uniques = pd.factorize(values)
+    masked = _mask_uniques(uniques)[codes]
+
+    # Split the masked values back into their columns
+    for col_name, col_values in zip(col_names, np.split(masked, len(col_names))):
+        df_copy[col_name] = pd.Series(col_values, index=df_copy.index, name=col_name)
         
     return df_copy
 
-def add_date_columns(df, date_col_name):
+def pseudonymize_values(series, key):
+    """
+    Returns a copy of the series with each value replaced by its keyed BLAKE2b
+    hash (16 hex digits), so that the same buyer gets the same pseudonym in
+    every export hashed with the same key, while the value cannot be recovered
+    or guessed without the key. Missing values stay NaN.
+
+    Each distinct value is hashed only once.
+    """
+    codes, uniques = pd.factorize(series.to_numpy(dtype=object))
+    pseudonyms = np.array(
+        [hashlib.blake2b(str(value).encode(), key=key, digest_size=8).hexdigest() for value in uniques] + [np.nan],
+        dtype=object)
+    return pd.Series(pseudonyms[codes], index=series.index, name=series.name)
+
+# Columns created by add_date_columns
+DATE_FEATURE_COLUMNS = ['sale_date_datetime', 'year', 'month', 'day', 'day_of_week', 'is_weekend']
+
+@instrumentation.timed()
+def add_date_columns(df, date_col_name, date_format='%m/%d/%y'):
     '''
     Takes a dataframe and the name of a column containing dates as input,
     and creates new columns for sale_date_datetime, year, month, day, day_of_week, and is_weekend.
+    String dates are parsed with date_format. Does nothing if the columns already exist.
     '''
-    # Convert the date column to a datetime object and create a new column for it
-    df['sale_date_datetime'] = pd.to_datetime(df[date_col_name])
-
-    # Extract year, month, day, and day of week components from the sale_date_datetime column
-    df['year'] = df['sale_date_datetime'].dt.year
-    df['month'] = df['sale_date_datetime'].dt.month
-    df['day'] = df['sale_date_datetime'].dt.day
-    df['day_of_week'] = df['sale_date_datetime'].dt.dayofweek
+    # The date features only need to be derived once per dataframe
+    if all(col_name in df.columns for col_name in DATE_FEATURE_COLUMNS):
+        return
+
+    # Convert the date column to a datetime object unless it already is one
+    sale_dates = df[date_col_name]
+    if not pd.api.types.is_datetime64_any_dtype(sale_dates):
+        sale_dates = pd.to_datetime(sale_dates, format=date_format)
+    df['sale_date_datetime'] = sale_dates
+
+    # Extract year, month, day, and day of week components with compact integer
+    # types, nullable ones when some sale dates are missing (blank or malformed)
+    int16, int8 = ('Int16', 'Int8') if sale_dates.isna().any() else ('int16', 'int8')
+    df['year'] = sale_dates.dt.year.astype(int16)
+    df['month'] = sale_dates.dt.month.astype(int8)
+    df['day'] = sale_dates.dt.day.astype(int8)
+    df['day_of_week'] = sale_dates.dt.dayofweek.astype(int8)
 
     # Create a new column that indicates whether the day is a weekend or not
-    df['is_weekend'] = df['day_of_week'].apply(lambda x: 1 if x >= 5 else 0)
+    df['is_weekend'] = df['day_of_week'] >= 5
+
+# Environment variable switching calculate_monthly_sum,
+# get_clean_sales_data_by_date and get_orders_by_state to the SQL queries of
+# sql_backend when set to 1
+SQL_BACKEND_ENV = 'ETSY_APP_SQL_BACKEND'
+
+def use_sql_backend():
+    """
+    Returns whether the aggregations run as SQL queries, as switched on by
+    the ETSY_APP_SQL_BACKEND environment variable.
+    """
+    return os.environ.get(SQL_BACKEND_ENV) == '1'
+
+def _sql_backend():
+    # Import sql_backend on first use, since it imports this module through
+    # aggregations
+    return instrumentation.import_module('sql_backend')
 
+@instrumentation.timed()
 def calculate_monthly_sum(df):
+    # Run the query of the SQL backend instead when it is switched on
+    if use_sql_backend():
+        return _sql_backend().calculate_monthly_sum(df)
+
     # Calculate the monthly sum of the 'Number of Items' column
     monthly_sum = df.groupby('month')['Number of Items'].sum()
 
@@ -68,11 +143,48 @@ def calculate_monthly_sum(df):
     # Return the resulting DataFrame
     return df_filled
 
-def plot_monthly_sales(df_monthly_sum):
+def percentage_labels(values, decimals=1):
+    """
+    Returns the share of each value in the total, formatted as percentage
+    labels such as '12.5%'. The total is computed once for all the values.
+    """
+    values = np.asarray(values, dtype='float64')
+    total = values.sum()
+    percentages = values / total * 100 if total else np.zeros_like(values)
+    return [f'{percentage:.{decimals}f}%' for percentage in percentages]
+
+def annotate_bars(ax, bars, labels, **text_kwargs):
+    """
+    Writes a label above each bar of a bar plot in one call to ax.bar_label.
+    Extra keyword arguments (fontsize, rotation, ...) are passed to the texts.
+    """
+    ax.bar_label(bars, labels=labels, padding=2, **text_kwargs)
+
+@instrumentation.timed()
+def calculate_year_month_sum(df):
+    # Calculate the sum of the 'Number of Items' column in each month of each year
+    monthly_sum = df.groupby(df['sale_date_datetime'].dt.to_period('M'))['Number of Items'].sum()
+
+    # Fill the months without sales between the first and last sale with zero
+    all_months = pd.period_range(monthly_sum.index.min(), monthly_sum.index.max(), freq='M')
+    monthly_sum = monthly_sum.reindex(all_months, fill_value=0).astype('float64')
+
+    # Return a DataFrame labelling the months like '2022-12'
+    return pd.DataFrame({'year_month': all_months.strftime('%Y-%m'), 'Number of Sold Items': monthly_sum.to_numpy()})
+
+@instrumentation.timed()
+def make_monthly_sales_figure(df_monthly_sum):
     
-    # Create a bar plot of the monthly sales
-    fig, ax = plt.subplots(figsize=(10, 6))
-    ax.bar(df_monthly_sum['month'], df_monthly_sum['Number of Sold Items'])
+    # Plot the months of the year, or the year-months of calculate_year_month_sum
+    month_col = 'year_month' if 'year_month' in df_monthly_sum.columns else 'month'
+
+    # Create a bar plot of the monthly sales on a figure outside pyplot's
+    # global registry, so it is freed as soon as it is no longer used
+    fig = new_figure(figsize=(10, 6))
+    ax = fig.subplots()
+    bars = ax.bar(df_monthly_sum[month_col], df_monthly_sum['Number of Sold Items'])
+    if month_col == 'year_month':
+        ax.tick_params(axis='x', labelrotation=90)
 
     # Set the plot title and axis labels
     ax.set_title('Monthly Sales')
@@ -80,41 +192,55 @@ def plot_monthly_sales(df_monthly_sum):
     ax.set_ylabel('Number of Sold Items')
 
     # Add percentages on the bars
-    for container in ax.containers:
-        for rect in container:
-            height = rect.get_height()
-            ax.text(rect.get_x() + rect.get_width() / 2, 
-                    height + 5, 
-                    f'{height/df_monthly_sum["Number of Sold Items"].sum():.1%}', 
-                    ha='center')
+    annotate_bars(ax, bars, percentage_labels(df_monthly_sum['Number of Sold Items']))
+    return fig
+
+def plot_monthly_sales(df_monthly_sum):
+    # Import Streamlit only to show plots, so the computations run without it
+    import streamlit as st
+
     # Show the plot
-    st.pyplot(fig)
+    st.pyplot(make_monthly_sales_figure(df_monthly_sum))
     
-def plot_sales_by_weekday_weekend(df):
+@instrumentation.timed()
+def get_sales_by_weekday_weekend(df):
     # Group the data by 'is_weekend' and get the sum of 'Number of Items'
-    df_grouped = df.groupby('is_weekend')['Number of Items'].sum()
+    return df.groupby('is_weekend')['Number of Items'].sum()
 
+def plot_sales_by_weekday_weekend(df):
+    # Plot the number of sales by Weekend/Weekday of the orders
+    plot_sales_by_weekday_weekend_totals(get_sales_by_weekday_weekend(df))
+
+@instrumentation.timed()
+def make_sales_by_weekday_weekend_figure(df_grouped):
     # Map the 'is_weekend' values to labels
     labels = ['Weekday', 'Weekend']
 
     # Create the pie chart
-    fig, ax = plt.subplots(figsize=(10, 6))
+    fig = new_figure(figsize=(10, 6))
+    ax = fig.subplots()
     wedges, labels, autopct = ax.pie(df_grouped, labels=labels, autopct='%1.1f%%', startangle=90)
 
     # Add the values next to the percentages
     for i in range(len(autopct)):
         x = autopct[i].get_position()[0]
         y = autopct[i].get_position()[1] + 0.1
-        ax.text(x, y, f"({df_grouped[i]})", ha='center', va='center')
+        ax.text(x, y, f"({df_grouped.iloc[i]})", ha='center', va='center')
 
     # Add the legend and format the plot
     ax.axis('equal')
     ax.set_title('Number of Sales by Weekday/Weekend')
     ax.legend()
 
+    return fig
+
+def plot_sales_by_weekday_weekend_totals(df_grouped):
+    import streamlit as st
+
     # Show the plot using Streamlit's st.pyplot() method
-    st.pyplot(fig)
+    st.pyplot(make_sales_by_weekday_weekend_figure(df_grouped))
     
+@instrumentation.timed()
 def get_orders_by_state(df):
     """
     Returns a DataFrame with the number of orders from the United States
@@ -128,15 +254,20 @@ def get_orders_by_state(df):
         pandas.DataFrame: A DataFrame containing the number of orders from
         the United States grouped by state.
     """
+    # Run the query of the SQL backend instead when it is switched on
+    if use_sql_backend():
+        return _sql_backend().get_orders_by_state(df)
+
     # Filter data to only include orders from the United States
     df_us = df[df['Ship Country'] == 'United States']
 
     # Group the data by state and count the number of orders
-    orders_by_state = df_us.groupby('Ship State')['Order ID'].nunique().reset_index()
+    orders_by_state = df_us.groupby('Ship State', observed=True)['Order ID'].nunique().reset_index()
     orders_by_state = orders_by_state.rename(columns={'Order ID': 'Number of Orders'})
 
     return orders_by_state
 
+@instrumentation.timed()
 def clean_orders_by_state(orders_by_state):
     """
     Cleans the DataFrame containing the number of orders from the United States
@@ -179,6 +310,7 @@ def clean_orders_by_state(orders_by_state):
 
     return orders_by_state
     
+@instrumentation.timed()
 def group_orders_by_state(orders_by_state, n=10, state_col='Ship State', orders_col='Number of Orders'):
     """
     Groups the orders by state into the top n states based on the number of orders,
@@ -220,7 +352,8 @@ def group_orders_by_state(orders_by_state, n=10, state_col='Ship State', orders_
     # Return the grouped orders DataFrame
     return grouped_orders
 
-def plot_orders_by_state_bar(orders_by_state):
+@instrumentation.timed()
+def make_orders_by_state_bar_figure(orders_by_state):
     """
     Generates a bar plot of the number of orders from the United States
     grouped by state, sorted in descending order of the number of orders.
@@ -234,7 +367,8 @@ def plot_orders_by_state_bar(orders_by_state):
     orders_by_state = orders_by_state.sort_values('Number of Orders', ascending=False)
 
     # Set the plot size
-    fig, ax = plt.subplots(figsize=(10, 5))
+    fig = new_figure(figsize=(10, 5))
+    ax = fig.subplots()
 
     # Create a bar plot of the number of orders by state
     ax.bar(orders_by_state['Ship State'], orders_by_state['Number of Orders'])
@@ -245,12 +379,18 @@ def plot_orders_by_state_bar(orders_by_state):
     ax.set_ylabel('Number of Orders')
 
     # Rotate the x-axis labels for better readability
-    plt.xticks(rotation=90)
+    ax.tick_params(axis='x', labelrotation=90)
+
+    return fig
+
+def plot_orders_by_state_bar(orders_by_state):
+    import streamlit as st
 
     # Show the plot using Streamlit's st.pyplot() method
-    st.pyplot(fig)
+    st.pyplot(make_orders_by_state_bar_figure(orders_by_state))
 
-def plot_orders_by_state_bar_with_percentage(orders_by_state):
+@instrumentation.timed()
+def make_orders_by_state_bar_with_percentage_figure(orders_by_state):
     """
     Creates a bar plot of the number of orders by state and adds percentages
     to the bars.
@@ -261,13 +401,14 @@ def plot_orders_by_state_bar_with_percentage(orders_by_state):
         State' and 'Number of Orders'.
 
     Returns:
-        None
+        matplotlib.figure.Figure: The bar plot.
     """
     # Sort the DataFrame by the number of orders in descending order
     orders_by_state = orders_by_state.sort_values('Number of Orders', ascending=False)
 
     # Set the plot size
-    fig, ax = plt.subplots(figsize=(10, 5))
+    fig = new_figure(figsize=(10, 5))
+    ax = fig.subplots()
 
     # Create a bar plot of the number of orders by state
     bar_plot = ax.bar(orders_by_state['Ship State'], orders_by_state['Number of Orders'])
@@ -278,23 +419,30 @@ def plot_orders_by_state_bar_with_percentage(orders_by_state):
     ax.set_ylabel('Number of Orders')
 
     # Rotate the x-axis labels for better readability
-    plt.xticks(rotation=90)
+    ax.tick_params(axis='x', labelrotation=90)
 
-    for bar in bar_plot:
-        value = bar.get_height()
-        percent = str(round((value / sum(orders_by_state['Number of Orders'])) * 100, 1)) + '%'
-        fontsize = (15 / len(bar_plot)) + 5
-        
-        rotation = 0
-        if len(bar_plot) > 31:
-            rotation = 90
-        
-        ax.text(bar.get_x() + bar.get_width()/2., value + 5, percent, ha='center', fontsize=fontsize, rotation=rotation)
+    # Add percentages on the bars, smaller and vertical when there are many bars
+    fontsize = (15 / len(bar_plot)) + 5
+    rotation = 90 if len(bar_plot) > 31 else 0
+    annotate_bars(ax, bar_plot, percentage_labels(orders_by_state['Number of Orders']), fontsize=fontsize, rotation=rotation)
+
+    return fig
+
+def plot_orders_by_state_bar_with_percentage(orders_by_state):
+    """
+    Shows the bar plot of make_orders_by_state_bar_with_percentage_figure.
+    """
+    import streamlit as st
 
     # Show the plot using Streamlit's st.pyplot() method
-    st.pyplot(fig)
+    st.pyplot(make_orders_by_state_bar_with_percentage_figure(orders_by_state))
     
+@instrumentation.timed()
 def get_clean_sales_data_by_date(df):
+    # Run the query of the SQL backend instead when it is switched on
+    if use_sql_backend():
+        return _sql_backend().get_clean_sales_data_by_date(df)
+
     # Group by sale_date_datetime and sum Number of Items
     grouped_df = df.groupby('sale_date_datetime')['Number of Items'].sum().reset_index()
 
@@ -310,7 +458,24 @@ def get_clean_sales_data_by_date(df):
     
     return merged_df
     
+def index_by_date(df, date_col='Date'):
+    """
+    Returns the DataFrame indexed by a sorted DatetimeIndex built from the
+    date column, which is kept as a column as well. filter_dataframe_by_date
+    slices such frames with a binary search instead of boolean masks.
+    """
+    indexed_df = df.sort_values(date_col, kind='mergesort')
+    indexed_df.index = pd.DatetimeIndex(indexed_df[date_col])
+    indexed_df.index.name = None
+    return indexed_df
+
+@instrumentation.timed()
 def filter_dataframe_by_date(df, start_date, end_date):
+    # If the dataframe is indexed by sorted dates (see index_by_date), find the
+    # range with a binary search and return a slice instead of a copy
+    if isinstance(df.index, pd.DatetimeIndex) and df.index.is_monotonic_increasing:
+        return df.loc[pd.Timestamp(start_date):pd.Timestamp(end_date)]
+
     # Convert start and end dates to datetime objects
     start_date = pd.to_datetime(start_date)
     end_date = pd.to_datetime(end_date)
@@ -320,16 +485,116 @@ def filter_dataframe_by_date(df, start_date, end_date):
     
     return filtered_df
 
-def plot_line_chart_plotly(df, x_col, y_col):
+# Time buckets of the line chart, from the finest to the coarsest, with their
+# length in days and pandas resampling rule
+LINE_CHART_RESOLUTIONS = [('day', 1, 'D'), ('week', 7, 'W'), ('month', 30, 'MS')]
+
+def choose_line_chart_resolution(n_days, width=700, px_per_point=1):
+    """
+    Returns the finest resolution of LINE_CHART_RESOLUTIONS ('day', 'week' or
+    'month') that draws a range of n_days with at most one point per
+    px_per_point pixels of a chart width pixels wide.
+    """
+    max_points = max(1, width // px_per_point)
+    for resolution, days, _ in LINE_CHART_RESOLUTIONS:
+        if n_days / days <= max_points:
+            return resolution
+    return LINE_CHART_RESOLUTIONS[-1][0]
+
+def resample_line_chart_data(df, x_col, y_col, resolution):
+    """
+    Sums the y column of a daily DataFrame into weekly or monthly buckets,
+    labelled by the date the bucket ends (weeks) or starts (months).
+    """
+    rule = {name: rule for name, _, rule in LINE_CHART_RESOLUTIONS}[resolution]
+    if rule == 'D':
+        return df[[x_col, y_col]]
+    return df.set_index(pd.DatetimeIndex(df[x_col]))[y_col].resample(rule).sum().rename_axis(x_col).reset_index()
+
+def downsample_lttb(df, x_col, y_col, n_out):
+    """
+    Returns n_out rows of the DataFrame chosen with the Largest-Triangle-Three-
+    Buckets algorithm, which keeps the visual shape of a line (its peaks and
+    troughs) with far fewer points. The first and last rows are always kept.
+    """
+    n = len(df)
+    if n_out >= n or n_out < 3:
+        return df
+
+    x = df[x_col].to_numpy().astype('datetime64[ns]').astype('int64').astype('float64')
+    y = df[y_col].to_numpy(dtype='float64')
+
+    # Split the inner points into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    selected = np.empty(n_out, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # The next bucket's average point is the third vertex of the triangle
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+
+        # Keep the point forming the largest triangle with the previous one
+        prev_x, prev_y = x[selected[i]], y[selected[i]]
+        areas = np.abs((prev_x - avg_x) * (y[start:end] - prev_y) - (prev_x - x[start:end]) * (avg_y - prev_y))
+        selected[i + 1] = start + int(np.argmax(areas))
+
+    return df.iloc[selected]
+
+@instrumentation.timed()
+def make_line_chart_figure(df, x_col, y_col, resolution='day', width=700, height=450, webgl_threshold=1000):
+    """
+    Creates a Plotly line chart of a daily DataFrame, bounding the number of
+    points sent to the browser on long date ranges.
+
+    Parameters:
+        df (pandas.DataFrame): A DataFrame with one row per day, such as the
+        output of get_clean_sales_data_by_date.
+        x_col (str): The name of the date column.
+        y_col (str): The name of the value column.
+        resolution (str): 'day', 'week' or 'month' to sum the values into
+        buckets of that length, 'auto' to pick the finest of them that fits
+        one point per pixel of width, or 'lttb' to keep at most width daily
+        points with downsample_lttb. Defaults to 'day'.
+        width (int): The width of the chart in pixels. Defaults to 700.
+        height (int): The height of the chart in pixels. Defaults to 450.
+        webgl_threshold (int): The number of points above which the line is
+        drawn with WebGL. Defaults to 1000.
+    """
+    # Reduce the number of points to draw
+    if resolution == 'auto':
+        resolution = choose_line_chart_resolution(len(df), width=width)
+    if resolution == 'lttb':
+        df = downsample_lttb(df, x_col, y_col, width)
+        y_title = y_col
+    else:
+        df = resample_line_chart_data(df, x_col, y_col, resolution)
+        y_title = y_col if resolution == 'day' else f'{y_col} per {resolution}'
+
+    # Import Plotly when the first line chart is drawn, it is slow to import
+    px = instrumentation.import_module('plotly.express')
+
     # Create a line plot of Total Quantity Sold by Date
-    fig = px.line(df, x=x_col, y=y_col)
+    render_mode = 'webgl' if len(df) > webgl_threshold else 'svg'
+    fig = px.line(df, x=x_col, y=y_col, render_mode=render_mode)
 
     # Set the title and axis labels
-    fig.update_layout(title=f'{y_col} by {x_col}', xaxis_title=x_col, yaxis_title=y_col)
+    fig.update_layout(title=f'{y_title} by {x_col}', xaxis_title=x_col, yaxis_title=y_title)
     
     # Set the figure size
-    fig.update_layout(width=700, height=450)
+    fig.update_layout(width=width, height=height)
+
+    return fig
+
+def plot_line_chart_plotly(df, x_col, y_col, resolution='day', width=700, height=450, webgl_threshold=1000):
+    """
+    Shows the Plotly line chart of make_line_chart_figure.
+    """
+    import streamlit as st
+
+    fig = make_line_chart_figure(df, x_col, y_col, resolution=resolution, width=width, height=height,
+                                 webgl_threshold=webgl_threshold)
 
     # Display the plot using Plotly's Streamlit figure renderer
     st.plotly_chart(fig)
-
@@ -0,0 +1,197 @@
+# Import libraries
+
+import functools
+from collections import namedtuple
+
+import streamlit as st
+
+import aggregations
+import cohorts
+import fulfillment
+import instrumentation
+import my_functions
+import rendering
+import revenue
+import sku_index
+
+# A part of the page: its name, the title shown to the user, the names of the
+# page inputs it is computed from, the function computing its result from
+# those inputs (None when it only shows them) and the function showing the
+# result, called with the PanelPage and the result
+Panel = namedtuple('Panel', ['name', 'title', 'inputs', 'compute', 'show'])
+
+# Number of orders shown at a time by the orders panel
+ORDERS_PAGE_ROWS = 1000
+
+# Define classes
+
+class PanelPage:
+    """
+    The panels of the app for one dataset. A panel is computed only when it is
+    shown, its result is memoized against the fingerprint of the dataset, and
+    the charts of the shown panels are rendered together by render_charts.
+
+    Parameters:
+        df (pandas.DataFrame): The orders, whose attrs['fingerprint']
+        identifies the dataset.
+        inputs: The inputs the panels can declare, by name. A function
+        without arguments is called the first time a shown panel needs it.
+    """
+
+    def __init__(self, df, **inputs):
+        self.df = df
+        self._inputs = inputs
+        self._charts = []
+
+    def input(self, name):
+        """
+        Returns the named input, computing it on first use.
+        """
+        value = self._inputs[name]
+        if callable(value):
+            value = self._inputs[name] = value()
+        return value
+
+    def compute(self, panel):
+        """
+        Returns the result of the panel, computed from its inputs only once
+        per dataset.
+        """
+        if panel.compute is None:
+            return None
+
+        def compute():
+            with instrumentation.stage('panel ' + panel.name):
+                return panel.compute(*[self.input(name) for name in panel.inputs])
+
+        return aggregations.memoize_by_fingerprint(self.df, 'panel:' + panel.name, compute)
+
+    def show(self, panel):
+        panel.show(self, self.compute(panel))
+
+    def tabs(self, panels, key=None):
+        """
+        Shows a choice between the panels and only the chosen one. Used in
+        place of st.tabs, whose tabs all run on every rerun.
+        """
+        titles = [panel.title for panel in panels]
+        title = st.radio("Panel", titles, horizontal=True, key=key, label_visibility='collapsed')
+        self.show(panels[titles.index(title)])
+
+    def expander(self, label, panel, expanded=False, key=None):
+        """
+        Shows a checkbox, and the panel while it is checked. Used in place of
+        st.expander, whose content runs even when it is collapsed. Returns
+        whether the panel is shown.
+        """
+        if not st.checkbox(label, value=expanded, key=key):
+            return False
+        self.show(panel)
+        return True
+
+    def chart(self, make_figure, data, **params):
+        """
+        Reserves the place of a matplotlib chart, rendered with the other
+        charts of the page by render_charts.
+        """
+        self._charts.append((st.empty(), rendering.RenderJob(make_figure, data, params)))
+
+    def render_charts(self):
+        """
+        Renders the reserved charts in parallel and shows them in their places.
+        """
+        images = rendering.render_many([job for _, job in self._charts])
+        for (placeholder, _), image in zip(self._charts, images):
+            placeholder.image(image)
+        self._charts = []
+
+# Define functions
+
+def show_orders(page, _):
+    # Send the browser one page of orders at a time rather than the whole frame
+    n_pages = max(1, -(-len(page.df) // ORDERS_PAGE_ROWS))
+    page_number = 1
+    if n_pages > 1:
+        page_number = st.number_input(f"Page ({ORDERS_PAGE_ROWS} orders per page)", 1, n_pages, 1)
+    start = (page_number - 1) * ORDERS_PAGE_ROWS
+    st.write(page.df.iloc[start:start + ORDERS_PAGE_ROWS])
+
+def monthly_sales_from_cube(cube):
+    # Sum the items sold by month, on a year-month axis when the orders span
+    # several years
+    if aggregations.spans_several_years(cube):
+        return aggregations.year_month_sum_from_cube(cube)
+    return aggregations.monthly_sum_from_cube(cube)
+
+def show_monthly_sales(page, df_monthly_sum):
+    page.chart(my_functions.make_monthly_sales_figure, df_monthly_sum)
+
+def show_weekday_weekend(page, weekday_weekend_totals):
+    page.chart(my_functions.make_sales_by_weekday_weekend_figure, weekday_weekend_totals)
+
+def monthly_revenue_metric(daily_revenue, metric):
+    # Sum the shared daily revenue by month and derive one metric from it
+    return revenue.revenue_metric(revenue.monthly_revenue(daily_revenue), metric)
+
+def show_revenue_metric(page, monthly_metric):
+    # Draw one point per month, without resampling
+    fig = my_functions.make_line_chart_figure(monthly_metric.reset_index(), 'Month', monthly_metric.name)
+    st.plotly_chart(fig)
+
+def show_fulfillment_latency(page, _):
+    # Sum the weekly histograms of the chosen date range, without going back
+    # to the orders
+    cube = page.input('latency_cube')
+    start_date, end_date = page.input('date_range')
+    overall = fulfillment.latency_percentiles(fulfillment.latency_histogram(cube, start_date, end_date, by=None))
+    weekly = fulfillment.latency_percentiles(fulfillment.latency_histogram(cube, start_date, end_date))
+    by_state = fulfillment.latency_percentiles(fulfillment.latency_histogram(cube, start_date, end_date, by='Ship State'))
+
+    for column, q in zip(st.columns(len(fulfillment.LATENCY_PERCENTILES)), fulfillment.LATENCY_PERCENTILES):
+        column.metric(f"p{q} days to ship", f"{overall[f'p{q}'].iloc[0]:.0f}")
+    st.line_chart(weekly[[f'p{q}' for q in fulfillment.LATENCY_PERCENTILES]])
+    st.dataframe(by_state.sort_values('Orders Shipped', ascending=False, kind='mergesort'))
+
+def show_top_products(page, _):
+    # Rank the products by range sums over the SKU index and draw the chosen
+    # one's row, without going back to the orders
+    index = page.input('sku_index')
+    start_date, end_date = page.input('date_range')
+    n = st.slider("Number of products", 1, 50, 10)
+    top = sku_index.top_skus(index, n, start_date, end_date)
+    if top.empty:
+        st.write("No orders with a SKU were sold in this date range.")
+        return
+    st.dataframe(top)
+
+    sku = st.selectbox("Product", top['SKU'])
+    daily = sku_index.sku_daily_sales(index, sku, start_date, end_date)
+    my_functions.plot_line_chart_plotly(daily, 'Date', 'Items Sold', resolution='auto')
+
+def show_cohorts(page, _):
+    # Show the repeat rate and the share of each cohort still buying in the
+    # following months, in percent
+    table = page.input('cohort_table')
+    if table.empty:
+        st.write("No orders have a buyer id.")
+        return
+    st.metric("Repeat purchase rate", f"{cohorts.repeat_purchase_rate(table):.1%}")
+    retention = (cohorts.retention_matrix(table) * 100).round(1)
+    retention.insert(0, 'Buyers', table['Buyers'])
+    st.dataframe(retention.rename(columns=str))
+
+# The panels of the app
+ORDERS_PANEL = Panel('orders', "Orders", (), None, show_orders)
+FULFILLMENT_PANEL = Panel('fulfillment', "Fulfillment latency", ('latency_cube', 'date_range'), None,
+                          show_fulfillment_latency)
+MONTHLY_SALES_PANEL = Panel('monthly_sales', "Number of Sold Items by Month", ('sales_cube',),
+                            monthly_sales_from_cube, show_monthly_sales)
+WEEKDAY_WEEKEND_PANEL = Panel('weekday_weekend', "Number of Sold Items by Weekend/Weekday", ('sales_cube',),
+                              aggregations.weekday_weekend_from_cube, show_weekday_weekend)
+TOP_PRODUCTS_PANEL = Panel('top_products', "Top products", ('sku_index', 'date_range'), None, show_top_products)
+COHORTS_PANEL = Panel('cohorts', "Repeat buyers", ('cohort_table',), None, show_cohorts)
+REVENUE_PANELS = [
+    Panel('revenue:' + metric, metric, ('daily_revenue',), functools.partial(monthly_revenue_metric, metric=metric),
+          show_revenue_metric)
+    for metric in revenue.REVENUE_METRICS
+]
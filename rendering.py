@@ -0,0 +1,194 @@
+# Import libraries
+
+import hashlib
+import io
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+
+import instrumentation
+
+# A chart to render: a function returning a matplotlib figure, the aggregate
+# it plots and its keyword arguments
+RenderJob = namedtuple('RenderJob', ['make_figure', 'data', 'params'], defaults=[None])
+
+# Define classes
+
+class RenderCache:
+    """
+    A thread-safe LRU cache of rendered images, bounded by their total size.
+
+    Parameters:
+        max_bytes (int): The maximum total size of the cached images.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, image):
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= len(self._entries.pop(key))
+            self._entries[key] = image
+            self._total_bytes += len(image)
+            # Evict the least recently used images until the rest fit
+            while self._total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= len(evicted)
+        return image
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+# Process-wide cache of the rendered charts
+render_cache = RenderCache()
+
+# Pool of processes rendering charts in parallel, created on first use
+_executor = None
+_executor_lock = threading.Lock()
+
+# Define functions
+
+def fingerprint_data(data):
+    """
+    Returns a hex digest identifying the values, index and column names of a
+    DataFrame or Series, such as the aggregate a chart is drawn from.
+    """
+    digest = hashlib.sha1(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+    names = list(data.columns) if isinstance(data, pd.DataFrame) else [data.name]
+    digest.update(repr(names).encode())
+    return digest.hexdigest()
+
+def render_figure(fig, fmt='png', dpi=100):
+    """
+    Renders a matplotlib figure to PNG or SVG bytes.
+    """
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format=fmt, dpi=dpi, bbox_inches='tight')
+    return buffer.getvalue()
+
+def _render_key(make_figure, data, fmt, dpi, params):
+    # Identify an image by the function, the data and the plot parameters
+    return (make_figure.__module__, make_figure.__qualname__, fingerprint_data(data),
+            fmt, dpi, tuple(sorted(params.items())))
+
+def _render_job(make_figure, data, fmt, dpi, params):
+    # Build and render a figure, releasing it as soon as it is rendered
+    fig = make_figure(data, **params)
+    try:
+        return render_figure(fig, fmt=fmt, dpi=dpi)
+    finally:
+        fig.clf()
+
+def _init_worker():
+    # Render without a display in the worker processes
+    import matplotlib
+    matplotlib.use('Agg')
+
+def _get_executor(max_workers):
+    # Start the worker processes with spawn, since forking the threaded
+    # Streamlit server is unsafe
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                            mp_context=multiprocessing.get_context('spawn'))
+        return _executor
+
+def shutdown_executor():
+    """
+    Stops the worker processes of render_many, if they were started.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
+
+def render_cached(make_figure, data, fmt='png', dpi=100, cache=render_cache, **params):
+    """
+    Returns the image of make_figure(data, **params), rendering it only if
+    the same function has not already been rendered for equal data and
+    parameters.
+
+    Parameters:
+        make_figure (function): A function returning a matplotlib figure,
+        such as my_functions.make_monthly_sales_figure.
+        data (pandas.DataFrame or pandas.Series): The aggregate to plot.
+        fmt (str): The image format, 'png' or 'svg'. Defaults to 'png'.
+        dpi (int): The resolution of PNG images. Defaults to 100.
+        cache (RenderCache): The cache to look up and store the image in.
+
+    Returns:
+        bytes: The rendered image.
+    """
+    key = _render_key(make_figure, data, fmt, dpi, params)
+
+    image = cache.get(key)
+    if image is None:
+        image = cache.put(key, _render_job(make_figure, data, fmt, dpi, params))
+    return image
+
+@instrumentation.timed()
+def render_many(jobs, fmt='png', dpi=100, cache=render_cache, max_workers=None):
+    """
+    Returns the images of several independent charts in the order of jobs.
+    The charts missing from the cache are rendered in parallel in a pool of
+    processes using the Agg backend, or in this process when only one is
+    missing or only one CPU is available.
+
+    Parameters:
+        jobs (list): The RenderJob of each chart. make_figure must be a
+        module-level function, so that it can be sent to another process.
+        fmt (str): The image format, 'png' or 'svg'. Defaults to 'png'.
+        dpi (int): The resolution of PNG images. Defaults to 100.
+        cache (RenderCache): The cache to look up and store the images in.
+        max_workers (int): The number of worker processes. Defaults to the
+        number of CPUs.
+
+    Returns:
+        list: The rendered image bytes of each job.
+    """
+    jobs = [job._replace(params=job.params or {}) for job in jobs]
+    keys = [_render_key(job.make_figure, job.data, fmt, dpi, job.params) for job in jobs]
+    images = [cache.get(key) for key in keys]
+    missing = [i for i, image in enumerate(images) if image is None]
+
+    max_workers = max_workers or os.cpu_count() or 1
+    if len(missing) > 1 and max_workers > 1:
+        try:
+            executor = _get_executor(max_workers)
+            futures = {i: executor.submit(_render_job, jobs[i].make_figure, jobs[i].data, fmt, dpi, jobs[i].params)
+                       for i in missing}
+            for i, future in futures.items():
+                images[i] = cache.put(keys[i], future.result())
+        except BrokenProcessPool:
+            # Start a new pool next time and render the rest here
+            shutdown_executor()
+
+    # Render what is left in this process
+    for i in missing:
+        if images[i] is None:
+            images[i] = cache.put(keys[i], _render_job(jobs[i].make_figure, jobs[i].data, fmt, dpi, jobs[i].params))
+
+    return images
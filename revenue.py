@@ -0,0 +1,115 @@
+# Import libraries
+
+import numpy as np
+import pandas as pd
+
+import etsy_schema
+import instrumentation
+
+# Columns replaced by an adjusted amount after a refund, with the column of
+# the adjusted amount, which is zero for orders that were not adjusted
+ADJUSTED_COLUMNS = {
+    'Order Total': 'Adjusted Order Total',
+    'Card Processing Fees': 'Adjusted Card Processing Fees',
+    'Order Net': 'Adjusted Net Order Amount',
+}
+
+# Series shown by the revenue panels, each the sum of its columns divided by
+# the sum of the denominator column, if any
+REVENUE_METRICS = {
+    'Revenue': (['Order Total'], None),
+    'Discounts': (['Discount Amount', 'Shipping Discount'], None),
+    'Card Processing Fees': (['Card Processing Fees'], None),
+    'Net': (['Order Net'], None),
+    'Net Margin': (['Order Net'], 'Order Total'),
+}
+
+# Define functions
+
+@instrumentation.timed()
+def build_daily_revenue(df):
+    """
+    Sums every money column of the orders by sale date. The day of each order
+    is computed once from the 'sale_date_datetime' column of add_date_columns
+    and shared by all the columns, each summed by a single np.bincount instead
+    of a groupby per column. The columns of ADJUSTED_COLUMNS sum the adjusted
+    amount of the orders adjusted after a refund and the original amount of
+    the others.
+
+    Parameters:
+        df (pandas.DataFrame): A DataFrame containing order data, with the
+        'sale_date_datetime' column of add_date_columns and any of the
+        etsy_schema.MONEY_COLUMNS. Missing amounts count as zero.
+
+    Returns:
+        pandas.DataFrame: One row per day between the first and last sale,
+        indexed by 'Date', with a float32 column per money column present.
+    """
+    columns = [col_name for col_name in etsy_schema.MONEY_COLUMNS if col_name in df.columns]
+    dates = df['sale_date_datetime'].to_numpy()
+    valid = ~np.isnat(dates)
+    if not valid.any():
+        return pd.DataFrame(columns=columns, dtype='float32', index=pd.DatetimeIndex([], name='Date'))
+    all_valid = valid.all()
+
+    # Number each order's day from the first sale
+    days = dates.astype('datetime64[D]').astype(np.int64)
+    if not all_valid:
+        days = days[valid]
+    first_day = days.min()
+    day_codes = days - first_day
+    n_days = int(day_codes.max()) + 1
+
+    # Sum each column in float64, so that long exports do not lose cents, and
+    # store the sums as float32
+    sums = np.empty((n_days, len(columns)), dtype=np.float32)
+    for i, col_name in enumerate(columns):
+        values = df[col_name].to_numpy(dtype=np.float64)
+        adjusted_col_name = ADJUSTED_COLUMNS.get(col_name)
+        if adjusted_col_name in df.columns:
+            adjusted = df[adjusted_col_name].to_numpy(dtype=np.float64)
+            values = np.where(np.nan_to_num(adjusted) != 0, adjusted, values)
+        if not all_valid:
+            values = values[valid]
+        if np.isnan(values).any():
+            values = np.nan_to_num(values)
+        sums[:, i] = np.bincount(day_codes, weights=values, minlength=n_days)
+
+    date_range = pd.date_range(start=pd.Timestamp(first_day, unit='D'), periods=n_days, freq='D', name='Date')
+    return pd.DataFrame(sums, index=date_range, columns=columns)
+
+def merge_daily_revenue(parts):
+    """
+    Adds the daily revenue of separate parts of the orders (such as the chunks
+    of a large export) into the daily revenue of all the orders.
+    """
+    revenue = pd.concat(parts).groupby(level='Date').sum()
+    date_range = pd.date_range(start=revenue.index.min(), end=revenue.index.max(), freq='D', name='Date')
+    return revenue.reindex(date_range, fill_value=0).astype(np.float32)
+
+def monthly_revenue(daily_revenue):
+    """
+    Sums the daily revenue of build_daily_revenue by month, indexed by the
+    first day of each month.
+    """
+    months = daily_revenue.index.to_period('M')
+    monthly = daily_revenue.groupby(months).sum().astype(np.float32)
+    monthly.index = monthly.index.to_timestamp().rename('Month')
+    return monthly
+
+def revenue_metric(revenue, metric):
+    """
+    Returns one of the REVENUE_METRICS of daily or monthly revenue as a
+    float32 Series. Ratios are those of the sums, NaN where the denominator
+    is zero.
+    """
+    columns, denominator = REVENUE_METRICS[metric]
+    values = np.zeros(len(revenue), dtype=np.float32)
+    for col_name in columns:
+        if col_name in revenue.columns:
+            values += revenue[col_name].to_numpy()
+    if denominator is not None:
+        total = revenue[denominator].to_numpy()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values = np.where(total != 0, values / total, np.float32(np.nan)).astype(np.float32)
+    return pd.Series(values, index=revenue.index, name=metric)
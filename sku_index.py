@@ -0,0 +1,150 @@
+# Import libraries
+
+import numpy as np
+import pandas as pd
+
+import fulfillment
+import instrumentation
+
+# Define functions
+
+def _index_from_entries(codes, skus, days, items):
+    # Sum the items of each (SKU code, day) pair and sort the pairs by SKU code
+    # and day, so that the rows of each SKU are contiguous like those of a CSR
+    # matrix and ordered by day
+    keys = (codes.astype(np.int64) << 32) | days.astype(np.int64)
+    keys, entry_codes = np.unique(keys, return_inverse=True)
+    sums = np.bincount(entry_codes.ravel(), weights=items, minlength=len(keys))
+
+    return pd.DataFrame({
+        'SKU': pd.Categorical.from_codes((keys >> 32).astype(np.int32), categories=skus),
+        'Key': keys,
+        'Items': sums.astype(np.float32),
+        'Cumulative Items': np.cumsum(sums),
+    })
+
+@instrumentation.timed()
+def build_sku_index(df):
+    """
+    Builds a sparse SKU x day matrix of the items sold, stored like a CSR
+    matrix: one row per (SKU, day) with sales, sorted by SKU code and day,
+    with a running total of the items, so that the items of any SKU over any
+    date range are the difference of two running totals found by binary
+    search.
+
+    Orders listing several comma-separated SKUs split their 'Number of Items'
+    evenly between them; orders without SKU are left out.
+
+    Parameters:
+        df (pandas.DataFrame): A DataFrame containing order data, including
+        columns 'Sale Date', 'SKU' and 'Number of Items'.
+
+    Returns:
+        pandas.DataFrame: The entries of the matrix, with the categorical
+        column 'SKU' (its codes are the matrix rows), 'Key' (the SKU code in
+        the high 32 bits and the day offset of fulfillment.day_offsets in the
+        low ones), 'Items' and 'Cumulative Items'.
+    """
+    skus = df['SKU']
+    days = fulfillment.day_offsets(df['Sale Date'])
+    has_sku = (skus.notna() & (skus != '')).to_numpy() & (days != fulfillment.MISSING_DAY)
+
+    # Split the distinct SKU fields rather than every order's field
+    field_codes, fields = pd.factorize(skus[has_sku])
+    field_skus = [[sku.strip() for sku in field.split(',')] for field in fields]
+    n_field_skus = np.array([len(parts) for parts in field_skus], dtype=np.int64)
+    sku_codes, sku_labels = pd.factorize(np.array([sku for parts in field_skus for sku in parts], dtype=object), sort=True)
+
+    # Give each listed SKU its share of the order's items
+    n_skus = n_field_skus[field_codes]
+    order_starts = np.cumsum(n_skus) - n_skus
+    field_starts = np.cumsum(n_field_skus) - n_field_skus
+    positions = np.repeat(field_starts[field_codes] - order_starts, n_skus) + np.arange(n_skus.sum())
+    items = np.repeat(df['Number of Items'].to_numpy(dtype=np.float64)[has_sku] / n_skus, n_skus)
+
+    return _index_from_entries(sku_codes[positions], sku_labels, np.repeat(days[has_sku], n_skus), items)
+
+def merge_sku_indexes(indexes):
+    """
+    Adds SKU indexes built from separate parts of the orders (such as the
+    chunks of a large export) into the SKU index of all the orders.
+    """
+    labels = np.concatenate([index['SKU'].astype(object).to_numpy() for index in indexes])
+    days = np.concatenate([index['Key'].to_numpy() & 0xFFFFFFFF for index in indexes])
+    items = np.concatenate([index['Items'].to_numpy(dtype=np.float64) for index in indexes])
+    codes, skus = pd.factorize(labels, sort=True)
+    return _index_from_entries(codes, skus, days, items)
+
+def _range_bounds(index, codes, start_day, end_day):
+    # Positions of the first and one past the last entry of each SKU code
+    # within the day range, by binary search over the sorted keys
+    keys = index['Key'].to_numpy()
+    codes = codes.astype(np.int64) << 32
+    return np.searchsorted(keys, codes | start_day), np.searchsorted(keys, codes | end_day, side='right')
+
+def _day_offset(date):
+    # Number of days between 1970-01-01 and a date
+    return int(np.datetime64(pd.Timestamp(date), 'D').astype(np.int64))
+
+def _day_range(start_date, end_date):
+    # Day offsets of the first and last day of a date range, open when None
+    start_day = 0 if start_date is None else max(_day_offset(start_date), 0)
+    end_day = np.iinfo(np.int32).max if end_date is None else _day_offset(end_date)
+    return start_day, end_day
+
+def sku_totals(index, start_date=None, end_date=None):
+    """
+    Returns the items sold of every SKU between start_date and end_date
+    (both included) as a Series indexed by SKU, in the order of the codes.
+    Takes two binary searches per SKU, whatever the number of orders.
+    """
+    start_day, end_day = _day_range(start_date, end_date)
+    skus = index['SKU'].cat.categories
+    lo, hi = _range_bounds(index, np.arange(len(skus)), start_day, end_day)
+
+    # The items of the entries lo to hi - 1 are the difference of running totals
+    cumulative = index['Cumulative Items'].to_numpy()
+    before = np.where(lo > 0, cumulative[np.maximum(lo - 1, 0)], 0.0)
+    through = np.where(hi > 0, cumulative[np.maximum(hi - 1, 0)], 0.0)
+    return pd.Series((through - before).astype(np.float32), index=pd.Index(skus, name='SKU'), name='Items Sold')
+
+def top_skus(index, k=10, start_date=None, end_date=None):
+    """
+    Returns the k SKUs with the most items sold between start_date and
+    end_date, in descending order, as a DataFrame with columns 'SKU' and
+    'Items Sold'. SKUs without sales in the range are left out.
+    """
+    totals = sku_totals(index, start_date, end_date)
+    values = totals.to_numpy()
+    k = min(k, len(values))
+    if k == 0:
+        return totals.iloc[:0].reset_index()
+
+    # Select the top k without sorting the whole catalog, then sort them
+    top = np.argpartition(-values, k - 1)[:k]
+    top = top[np.lexsort((top, -values[top]))]
+    top = top[values[top] > 0]
+    return totals.iloc[top].reset_index()
+
+def sku_daily_sales(index, sku, start_date=None, end_date=None):
+    """
+    Returns the items sold of one SKU on every day between start_date and
+    end_date, or else between its first and last sale, as a DataFrame with
+    columns 'Date' and 'Items Sold'. Only the row of the SKU is read.
+    """
+    codes = index['SKU'].cat.categories.get_indexer([sku])
+    start_day, end_day = _day_range(start_date, end_date)
+    lo, hi = 0, 0
+    if codes[0] >= 0:
+        (lo,), (hi,) = _range_bounds(index, codes, start_day, end_day)
+    days = index['Key'].to_numpy()[lo:hi] & 0xFFFFFFFF
+    items = index['Items'].to_numpy()[lo:hi]
+
+    # Fill the days without sales with zero
+    first_day = start_day if start_date is not None else (int(days[0]) if len(days) else 0)
+    last_day = end_day if end_date is not None else (int(days[-1]) if len(days) else first_day - 1)
+    sales = np.zeros(max(last_day - first_day + 1, 0), dtype=np.float32)
+    sales[days - first_day] = items
+
+    dates = pd.to_datetime(np.arange(first_day, first_day + len(sales)), unit='D')
+    return pd.DataFrame({'Date': dates, 'Items Sold': sales})
@@ -0,0 +1,189 @@
+# Import libraries
+
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+import aggregations
+import fulfillment
+import instrumentation
+
+# Number of datasets whose orders table is kept registered at once
+MAX_CONNECTIONS = 2
+
+# The queries of the backend, by name. The orders table has one row per order
+# with the columns of orders_table; days are numbers of days since 1970-01-01
+QUERIES = {
+    # The items sold in each month 1-12, like my_functions.calculate_monthly_sum
+    'monthly_sum': """
+        WITH RECURSIVE months(month) AS (
+            SELECT 1 UNION ALL SELECT month + 1 FROM months WHERE month < 12
+        ),
+        sales AS (
+            SELECT month, SUM(items) AS items FROM orders GROUP BY month
+        )
+        SELECT months.month AS month,
+               COALESCE(sales.items, 0) AS "Number of Sold Items"
+        FROM months LEFT JOIN sales ON sales.month = months.month
+        ORDER BY months.month
+    """,
+    # The items sold on every day between the first and last sale, like
+    # my_functions.get_clean_sales_data_by_date
+    'daily_sales': """
+        WITH RECURSIVE sales AS (
+            SELECT sale_day, SUM(items) AS items FROM orders GROUP BY sale_day
+        ),
+        days(day) AS (
+            SELECT MIN(sale_day) FROM sales
+            UNION ALL
+            SELECT day + 1 FROM days WHERE day < (SELECT MAX(sale_day) FROM sales)
+        )
+        SELECT days.day AS day,
+               COALESCE(sales.items, 0) AS "Total Quantity Sold"
+        FROM days LEFT JOIN sales ON sales.sale_day = days.day
+        WHERE days.day IS NOT NULL
+        ORDER BY days.day
+    """,
+    # The number of orders from the United States by state, like
+    # my_functions.get_orders_by_state
+    'orders_by_state': """
+        SELECT state AS "Ship State",
+               COUNT(DISTINCT order_id) AS "Number of Orders"
+        FROM orders
+        WHERE country = 'United States' AND state IS NOT NULL
+        GROUP BY state
+        ORDER BY state
+    """,
+}
+
+# Connections holding the orders table of the latest datasets, by fingerprint
+_connections = OrderedDict()
+_connections_lock = threading.Lock()
+
+# Define classes
+
+class OrdersDatabase:
+    """
+    An in-process database holding the orders of one dataset as the table
+    'orders'. Uses DuckDB, whose columnar engine scans the registered frame
+    without copying it and runs queries on all cores, when it is installed,
+    or else an in-memory SQLite database, which copies the orders into its
+    row store and is slower than the pandas functions.
+
+    Parameters:
+        df (pandas.DataFrame): The orders, with the date columns of
+        my_functions.add_date_columns.
+    """
+
+    def __init__(self, df):
+        table = orders_table(df)
+        self.engine = available_engine()
+        self._lock = threading.Lock()
+
+        with instrumentation.stage('register orders table', rows=len(table)):
+            if self.engine == 'duckdb':
+                # DuckDB reads the frame in place, so it must be kept alive
+                self._connection = instrumentation.import_module('duckdb').connect()
+                self._connection.register('orders', table)
+                self.table = table
+            else:
+                # SQLite holds its own copy of the orders
+                self._connection = sqlite3.connect(':memory:', check_same_thread=False)
+                table.to_sql('orders', self._connection, index=False)
+
+    def query(self, sql):
+        """
+        Runs a query and returns its result as a DataFrame.
+        """
+        with self._lock:
+            if self.engine == 'duckdb':
+                return self._connection.execute(sql).df()
+            return pd.read_sql_query(sql, self._connection)
+
+# Define functions
+
+def available_engine():
+    """
+    Returns the engine the queries run on: 'duckdb' when DuckDB is installed,
+    or else 'sqlite'.
+    """
+    try:
+        instrumentation.import_module('duckdb')
+    except ImportError:
+        return 'sqlite'
+    return 'duckdb'
+
+def orders_table(df):
+    """
+    Returns the columns of the orders the queries use, with short names and
+    plain types both engines can store: 'sale_day' (days since 1970-01-01),
+    'month', 'items', 'order_id', 'state' and 'country'. The day and month of
+    orders without a sale date are NULL.
+    """
+    sale_days = fulfillment.day_offsets(df['sale_date_datetime'])
+    return pd.DataFrame({
+        'sale_day': pd.arrays.IntegerArray(sale_days, sale_days == fulfillment.MISSING_DAY),
+        'month': df['month'].astype('Int32').array,
+        'items': df['Number of Items'].to_numpy(),
+        'order_id': df['Order ID'].to_numpy(),
+        'state': df['Ship State'].astype(object).to_numpy(),
+        'country': df['Ship Country'].astype(object).to_numpy(),
+    })
+
+def get_database(df):
+    """
+    Returns the OrdersDatabase of the orders, registering them only once per
+    dataset. Without a fingerprint the database is not kept.
+    """
+    fingerprint = df.attrs.get('fingerprint')
+    if fingerprint is None:
+        return OrdersDatabase(df)
+
+    with _connections_lock:
+        database = _connections.get(fingerprint)
+        if database is None:
+            database = _connections[fingerprint] = OrdersDatabase(df)
+            while len(_connections) > MAX_CONNECTIONS:
+                _connections.popitem(last=False)
+        _connections.move_to_end(fingerprint)
+    return database
+
+def run_query(df, name):
+    """
+    Returns the result of one of the QUERIES over the orders, memoized in
+    aggregations.cube_cache per query and dataset fingerprint.
+    """
+    def compute():
+        with instrumentation.stage('sql ' + name):
+            return get_database(df).query(QUERIES[name])
+
+    return aggregations.memoize_by_fingerprint(df, 'sql:' + name, compute)
+
+def calculate_monthly_sum(df):
+    """
+    Returns the same DataFrame as my_functions.calculate_monthly_sum,
+    computed by the query engine.
+    """
+    monthly = run_query(df, 'monthly_sum')
+    return monthly.astype({'month': 'int64', 'Number of Sold Items': 'float64'})
+
+def get_clean_sales_data_by_date(df):
+    """
+    Returns the same DataFrame as my_functions.get_clean_sales_data_by_date,
+    computed by the query engine.
+    """
+    daily = run_query(df, 'daily_sales')
+    return pd.DataFrame({
+        'Date': pd.to_datetime(daily['day'].to_numpy(dtype='int64'), unit='D'),
+        'Total Quantity Sold': daily['Total Quantity Sold'].to_numpy(dtype='float64'),
+    })
+
+def get_orders_by_state(df):
+    """
+    Returns the same DataFrame as my_functions.get_orders_by_state, computed
+    by the query engine, with the states sorted by name.
+    """
+    orders_by_state = run_query(df, 'orders_by_state')
+    return orders_by_state.astype({'Ship State': object, 'Number of Orders': 'int64'})